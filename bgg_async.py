@@ -0,0 +1,89 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import bgg_core
+
+# Threads running blocking requests and prompts for the event loop. Requests
+# still share bgg_core's rate limiter, session and response cache.
+executor = ThreadPoolExecutor(16, thread_name_prefix="bgg_async")
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking function on the executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def get_data(base_type, params):
+    """Download data from BGG API, or get it from the response cache."""
+    return await run(bgg_core.get_data, base_type, params)
+
+
+async def find_game(search):
+    """Search for game matches."""
+    return await run(bgg_core.find_game, search)
+
+
+async def get_games_info(ids, chunk_size=20):
+    """Get dict of info for each game id."""
+    return await run(bgg_core.get_games_info, ids, chunk_size)
+
+
+async def get_game_names(ids):
+    """Get dict of game names from IDs."""
+    return await run(bgg_core.get_game_names, ids)
+
+
+async def read_data(id, dir, func, update=False, store=None):
+    """Read data into dict, downloading it if needed."""
+    return await run(bgg_core.read_data, id, dir, func, update, store)
+
+
+async def select_game():
+    """Ask for game to analyze, letting other tasks run while waiting for input."""
+
+    search = await run(input, "Enter board game to search (leave empty if finished):")
+
+    if not search:
+        raise ValueError
+
+    matches = await find_game(search)
+
+    print("Games found:")
+    for id, name in matches.items():
+        print(id + "\t" + name)
+    game_id = await run(input, "Enter the number before the intended game:")
+    name = matches[game_id]
+
+    return game_id, name
+
+
+async def select_games(dir, func, store=None):
+    """
+    Ask for games until no input, downloading data for each in the background.
+    Data for a game starts downloading as soon as it is selected, while the
+    next one is searched for, and all downloads run concurrently. A game
+    selected twice is only downloaded once.
+    Returns a list of (id, name) pairs once every download has finished.
+    """
+
+    games = []
+    # Download task of each selected game id.
+    downloads = {}
+
+    while True:
+        try:
+            game_id, name = await select_game()
+        # Stop search if no input.
+        except ValueError:
+            break
+        except KeyError:
+            print("No game found with that number.")
+            continue
+        games.append((game_id, name))
+        if game_id not in downloads and (store is None or game_id not in store):
+            downloads[game_id] = asyncio.create_task(read_data(game_id, dir, func, store=store))
+
+    await asyncio.gather(*downloads.values())
+    return games
@@ -0,0 +1,548 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import bgg_compare
+import bgg_core
+import bgg_parse
+import bgg_plays
+import bgg_store
+import bgg_time
+import bgg_users
+
+# Sizes of the synthetic catalogs that end-to-end benchmarks run at.
+scales = {
+    "small": {"num_games": 10, "num_users": 5000, "density": 0.3, "num_plays": 2000},
+    "medium": {"num_games": 30, "num_users": 30000, "density": 0.2, "num_plays": 10000},
+    "large": {"num_games": 100, "num_users": 100000, "density": 0.1, "num_plays": 30000},
+}
+
+# Timings recorded by benchmarks in this run, written out by write_results.
+records = []
+
+
+def random_user_game_matrix(num_games, num_users, density=0.3, seed=0):
+    """Generate a games x users matrix of random ratings with NaN for missing ratings."""
+    rng = np.random.default_rng(seed)
+    user_game_mat = rng.integers(2, 21, size=(num_games, num_users)) / 2
+    user_game_mat[rng.random((num_games, num_users)) > density] = np.nan
+    return user_game_mat
+
+
+def random_pairwise_wins(num_games, num_users=10000, seed=0):
+    """
+    Generate a games x games matrix of pairwise wins.
+    Games have a random underlying quality, with enough noise in the counts that
+    IRV often has to remove plurality losers before finding a winner.
+    """
+    rng = np.random.default_rng(seed)
+    quality = rng.normal(size=num_games)
+    prob = 1 / (1 + np.exp(-(quality[:, None] - quality[None, :])))
+    wins = rng.binomial(num_users // 10, prob)
+    np.fill_diagonal(wins, 0)
+    return wins
+
+
+def ratings_page(page, pagesize=100, total=10000, seed=0):
+    """Generate a thing response page with rating comments."""
+    rng = np.random.default_rng(seed + page)
+    comments = "".join(
+        '<comment username="user%d" rating="%s" value="Comment &amp; more"/>'
+        % (rng.integers(1000000), rng.integers(2, 21) / 2) for _ in range(pagesize))
+    return ('<?xml version="1.0" encoding="utf-8"?><items><item type="boardgame" id="1">'
+            '<name type="primary" sortindex="1" value="Game"/>'
+            '<comments page="%d" totalitems="%d">%s</comments></item></items>'
+            % (page, total, comments))
+
+
+def plays_page(page, pagesize=100, total=10000, seed=0):
+    """Generate a plays response page."""
+    rng = np.random.default_rng(seed + page)
+    plays = []
+    for i in range(pagesize):
+        players = "".join('<player username="p%d" userid="%d" name="P" score="%d" win="0"/>'
+                          % (j, j, j) for j in range(rng.integers(0, 6)))
+        plays.append('<play id="%d" date="2020-%02d-%02d" quantity="%d" length="%d" '
+                     'incomplete="0" nowinstats="0" location="" userid="%d">'
+                     '<item name="Game" objecttype="thing" objectid="1"/>'
+                     '<players>%s</players></play>'
+                     % (page * pagesize + i, rng.integers(1, 13), rng.integers(1, 29),
+                        rng.integers(1, 3), rng.integers(0, 240), rng.integers(100000),
+                        players))
+    return ('<?xml version="1.0" encoding="utf-8"?><plays username="" userid="0" total="%d" '
+            'page="%d">%s</plays>' % (total, page, "".join(plays)))
+
+
+class SyntheticData(object):
+    """
+    Random catalog of games with ratings and plays, rendered as API responses.
+
+    Games have an underlying quality and users a bias, so that rankings have a
+    true order to find. Users rate each game with probability density on
+    average, with a few very active users rating most games, and plays are
+    logged mostly by users who rated the game, so ratings and plays can be
+    joined. Users have the names user<n> and user ids 1000 + n. Plays have
+    ids in the order they were logged, which stay the same as plays are added.
+    """
+
+    def __init__(self, num_games=10, num_users=5000, density=0.3, num_plays=2000, seed=0):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.next_play_id = 1
+        self.ids = [str(i) for i in range(1, num_games + 1)]
+        self.num_users = num_users
+        self.years = dict(zip(self.ids, rng.integers(1990, 2020, num_games).tolist()))
+        quality = rng.normal(0, 0.7, num_games)
+        bias = rng.normal(0, 0.8, num_users)
+        activity = rng.lognormal(0, 1.5, num_users)
+        rate_prob = np.minimum(1, density * activity / activity.mean())
+
+        self.ratings = {}
+        self.plays = {}
+        for game_id, game_quality in zip(self.ids, quality):
+            users = np.flatnonzero(rng.random(num_users) < rate_prob)
+            ratings = np.round(7 + game_quality + bias[users] + rng.normal(0, 1, len(users)))
+            self.ratings[game_id] = (users, np.clip(ratings, 1, 10))
+
+            raters = users[rng.random(len(users)) < 0.8] if len(users) else users
+            players = np.where(rng.random(num_plays) < 0.9, rng.choice(raters, num_plays),
+                               rng.integers(0, num_users, num_plays)) \
+                if len(raters) else rng.integers(0, num_users, num_plays)
+            days = np.sort(rng.integers(0, 3650, num_plays))[::-1]
+            self.plays[game_id] = self._new_plays(
+                players, (np.datetime64("2010-01-01") + days).astype(str))
+
+    def _new_plays(self, users, dates):
+        """Make columns of plays by users on dates, given newest first."""
+        rng = self.rng
+        num_plays = len(users)
+        ids = self.next_play_id + np.arange(num_plays)[::-1]
+        self.next_play_id += num_plays
+        return {
+            "id": ids,
+            "user": np.asarray(users),
+            "date": np.asarray(dates),
+            "length": np.where(rng.random(num_plays) < 0.6, rng.integers(10, 240, num_plays), 0),
+            "quantity": rng.integers(1, 3, num_plays),
+            "players": rng.integers(0, 6, num_plays),
+        }
+
+    def add_plays(self, game_id, dates):
+        """
+        Log new plays of a game by random users, given their YYYY-MM-DD dates,
+        which may be older than plays already logged. Returns their play ids.
+        """
+        dates = np.sort(np.asarray(dates, dtype=str))[::-1]
+        new = self._new_plays(self.rng.integers(0, self.num_users, len(dates)), dates)
+        plays = {key: np.concatenate([column, new[key]])
+                 for key, column in self.plays[game_id].items()}
+        # Newest first, and most recently logged first on the same date.
+        order = np.lexsort((plays["id"], plays["date"]))[::-1]
+        self.plays[game_id] = {key: column[order] for key, column in plays.items()}
+        return new["id"]
+
+    def ratings_dict(self, game_id):
+        """Get ratings of a game as a dict of user-rating pairs."""
+        users, ratings = self.ratings[game_id]
+        return {"user%d" % u: float(r) for u, r in zip(users, ratings)}
+
+    def ratings_page(self, game_id, page, pagesize=100):
+        """Render a page of rating comments, empty past the last rating."""
+        users, ratings = self.ratings[game_id]
+        start = (page - 1) * pagesize
+        comments = "".join('<comment username="user%d" rating="%g" value=""/>' % (u, r)
+                           for u, r in zip(users[start:start + pagesize],
+                                           ratings[start:start + pagesize]))
+        return ('<?xml version="1.0" encoding="utf-8"?><items><item type="boardgame" id="%s">'
+                '<comments page="%d" totalitems="%d">%s</comments></item></items>'
+                % (game_id, page, len(users), comments))
+
+    def plays_page(self, game_id, page, pagesize=100, mindate=None):
+        """
+        Render a page of plays, newest first, empty past the last play.
+        With mindate, only plays dated on or after it are included.
+        """
+        plays = self.plays[game_id]
+        if mindate:
+            plays = {key: column[plays["date"] >= mindate] for key, column in plays.items()}
+        total = len(plays["user"])
+        start = (page - 1) * pagesize
+        rows = []
+        for i in range(start, min(start + pagesize, total)):
+            rows.append('<play id="%d" date="%s" quantity="%d" length="%d" incomplete="0" '
+                        'nowinstats="0" location="" userid="%d">'
+                        '<item name="Game" objecttype="thing" objectid="%s"/>'
+                        '<players>%s</players></play>'
+                        % (plays["id"][i], plays["date"][i], plays["quantity"][i],
+                           plays["length"][i], 1000 + plays["user"][i], game_id,
+                           '<player userid="0" name="P"/>' * int(plays["players"][i])))
+        return ('<?xml version="1.0" encoding="utf-8"?><plays username="" userid="0" total="%d" '
+                'page="%d">%s</plays>' % (total, page, "".join(rows)))
+
+    def things_page(self, ids):
+        """Render info for game ids."""
+        items = "".join('<item type="boardgame" id="%s"><name type="primary" sortindex="1" '
+                        'value="Game %s"/><yearpublished value="%d"/><minplayers value="1"/>'
+                        '<maxplayers value="5"/><playingtime value="60"/></item>'
+                        % (game_id, game_id, self.years[game_id])
+                        for game_id in ids if game_id in self.years)
+        return '<?xml version="1.0" encoding="utf-8"?><items>%s</items>' % items
+
+    def usernames(self):
+        """Get dict of usernames of every user id."""
+        return {1000 + u: "user%d" % u for u in range(self.num_users)}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer API requests from the server's synthetic data."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        data = self.server.data
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path.endswith("/thing") and params.get("ratingcomments"):
+            body = data.ratings_page(params["id"], int(params.get("page", 1)))
+        elif url.path.endswith("/thing"):
+            body = data.things_page(params["id"].split(","))
+        elif url.path.endswith("/plays"):
+            body = data.plays_page(params["id"], int(params.get("page", 1)),
+                                   mindate=params.get("mindate"))
+        else:
+            self.send_error(404)
+            return
+
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def stub_server(data, latency=0):
+    """
+    Serve synthetic data from a local stub of the API in a temporary directory.
+    bgg_core is pointed at the stub, with no rate limit or response cache, and
+    downloaded data is written to the temporary directory, which is the working
+    directory inside the with block. Everything is restored on exit.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.data = data
+    server.latency = latency
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    saved = (bgg_core.base_url, bgg_core.limiter, bgg_core.response_cache,
+             bgg_core.pager_workers, bgg_core.info_cache)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            os.chdir(tmp_dir)
+            bgg_core.base_url = "http://127.0.0.1:%d/xmlapi2" % server.server_address[1]
+            bgg_core.limiter = bgg_core.RateLimiter(1e9, burst=1e9)
+            bgg_core.response_cache = None
+            bgg_core.info_cache = None
+            # Plays only join to ratings once their user ids have usernames.
+            bgg_users.open_table().add_userids(data.usernames())
+            yield server
+        finally:
+            os.chdir(cwd)
+            (bgg_core.base_url, bgg_core.limiter, bgg_core.response_cache,
+             bgg_core.pager_workers, bgg_core.info_cache) = saved
+            bgg_users.tables.pop(os.path.join(tmp_dir, "users"), None)
+            server.shutdown()
+            server.server_close()
+
+
+def remove(*paths):
+    """Remove files or directories, if they exist."""
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def record(bench, seconds, **params):
+    """Record the time taken by a benchmark with the given parameters."""
+    records.append(dict(bench=bench, seconds=seconds, **params))
+
+
+def timeit(func, *args, repeat=3):
+    """Return best wall time of func over repeated calls."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_pairwise(games=(10, 50, 100, 200), users=(1000, 10000, 50000), repeat=3):
+    """Time pairwise win and top rating counts over numbers of games and users."""
+    results = []
+    for num_games in games:
+        for num_users in users:
+            user_game_mat = random_user_game_matrix(num_games, num_users)
+            wins_time = timeit(bgg_compare.pairwise_wins, user_game_mat, repeat=repeat)
+            top_time = timeit(bgg_compare.top_rating_counts, user_game_mat, repeat=repeat)
+            results.append((num_games, num_users, wins_time, top_time))
+            record("pairwise_wins", wins_time, games=num_games, users=num_users)
+            record("top_rating_counts", top_time, games=num_games, users=num_users)
+            print("%d\t%d\t%.4f\t%.4f" % results[-1])
+    return results
+
+
+def bench_ranking(games=(100, 300, 1000, 3000), repeat=3):
+    """Time condorcet-IRV ranking from pairwise wins over numbers of games."""
+    results = []
+    for num_games in games:
+        cond_mat = random_pairwise_wins(num_games)
+        rng = np.random.default_rng(num_games)
+        top_ratings = rng.integers(0, 1000, num_games)
+        votes = rng.integers(100, 10000, num_games)
+        ids = [str(i) for i in range(1, num_games + 1)]
+        years = rng.integers(1990, 2020, num_games)
+        rank_time = timeit(bgg_compare.condorcet_irv_rank, cond_mat, top_ratings, votes, ids,
+                           years, repeat=repeat)
+        results.append((num_games, rank_time))
+        record("condorcet_irv_rank", rank_time, games=num_games)
+        print("%d\t%.4f" % results[-1])
+    return results
+
+
+def bench_parsers(pages=20, repeat=3):
+    """Time each parser backend on generated ratings and plays pages."""
+    page_sets = {"ratings": (bgg_parse.parse_ratings, [ratings_page(p) for p in range(pages)]),
+                 "plays": (bgg_parse.parse_plays, [plays_page(p) for p in range(pages)])}
+    backend = bgg_parse.backend
+    results = []
+
+    try:
+        for name, (parse, texts) in page_sets.items():
+            outputs = {}
+            for parser in ["soup", "etree"]:
+                bgg_parse.backend = parser
+                outputs[parser] = [parse(text) for text in texts]
+                parse_time = timeit(lambda: [parse(text) for text in texts], repeat=repeat)
+                results.append((name, parser, parse_time / pages))
+                record("parse_" + name, parse_time / pages, backend=parser)
+                print("%s\t%s\t%.5f" % results[-1])
+            assert outputs["soup"] == outputs["etree"], "parser outputs differ for %s" % name
+    finally:
+        bgg_parse.backend = backend
+
+    return results
+
+
+def bench_fetch(data, scale, workers=(1, 4), repeat=1):
+    """
+    Time downloading ratings and plays of every game from the stub server,
+    through the pager, parsers, record logs and rating store.
+    """
+    results = []
+    for pager_workers in workers:
+        bgg_core.pager_workers = pager_workers
+        for dir, func in [("ratings", bgg_compare.get_ratings), ("plays", bgg_time.get_plays)]:
+            def fetch():
+                remove(dir)
+                store = bgg_store.RatingStore("bench_store") if dir == "ratings" else None
+                for game_id in data.ids:
+                    bgg_core.read_data(game_id, dir, func, store=store)
+                remove("bench_store")
+
+            fetch_time = timeit(fetch, repeat=repeat)
+            results.append((dir, pager_workers, fetch_time))
+            record("fetch_" + dir, fetch_time, scale=scale, pager_workers=pager_workers)
+            print("%s\t%s\t%d\t%.4f" % (scale, dir, pager_workers, fetch_time))
+    return results
+
+
+def bench_compare(data, scale, num_games=(2, 5, 10), repeat=3):
+    """Time comparing common-user averages from dicts and from the rating store."""
+    store = bgg_compare.load_ratings(data.ids)
+    results = []
+    for n in num_games:
+        ids = data.ids[:n]
+        ratings_list = [data.ratings_dict(game_id) for game_id in ids]
+        dict_time = timeit(bgg_compare.compare_ratings, ratings_list, repeat=repeat)
+        stored_time = timeit(bgg_compare.compare_stored_ratings, store, ids, repeat=repeat)
+        results.append((n, dict_time, stored_time))
+        record("compare_ratings", dict_time, scale=scale, games=n)
+        record("compare_stored_ratings", stored_time, scale=scale, games=n)
+        print("%s\t%d\t%.4f\t%.4f" % (scale, n, dict_time, stored_time))
+    return results
+
+
+def bench_condorcet(data, scale, repeat=3):
+    """
+    Time condorcet-IRV ranking of every game from dicts, streamed in blocks,
+    and from the rating store, building the pair matrix and then reusing it.
+    """
+    ids = data.ids
+    store = bgg_compare.load_ratings(ids)
+    ratings_list = [data.ratings_dict(game_id) for game_id in ids]
+    bgg_core.get_games_info(ids)
+
+    def build():
+        remove("bench_pairs")
+        bgg_compare.condorcet_irv_stored(store, ids, "bench_pairs")
+
+    times = {
+        "condorcet_irv": timeit(bgg_compare.condorcet_irv, ratings_list, ids, repeat=repeat),
+        "condorcet_irv_streamed": timeit(bgg_compare.condorcet_irv, ratings_list, ids, 2 ** 24,
+                                         repeat=repeat),
+        "condorcet_irv_stored_build": timeit(build, repeat=repeat),
+        "condorcet_irv_stored": timeit(bgg_compare.condorcet_irv_stored, store, ids,
+                                       "bench_pairs", repeat=repeat),
+    }
+    for bench, seconds in times.items():
+        record(bench, seconds, scale=scale, games=len(ids))
+        print("%s\t%s\t%.4f" % (scale, bench, seconds))
+    return times
+
+
+def bench_play_stats(data, scale, repeat=3):
+    """Time play stats of every game from cached play columns, and joined with ratings."""
+    ids = data.ids
+    for game_id in ids:
+        bgg_time.read_play_columns(game_id)
+    bgg_compare.load_ratings(ids)
+    bgg_core.get_games_info(ids)
+
+    times = {
+        "play_stats": timeit(lambda: [bgg_time.play_stats(game_id) for game_id in ids],
+                             repeat=repeat),
+        "play_stats_by_players": timeit(
+            lambda: [bgg_time.play_stats_by_players(game_id) for game_id in ids], repeat=repeat),
+        "joined_stats": timeit(bgg_plays.joined_stats, ids, 1, repeat=repeat),
+    }
+    for bench, seconds in times.items():
+        record(bench, seconds, scale=scale, games=len(ids))
+        print("%s\t%s\t%.4f" % (scale, bench, seconds))
+    return times
+
+
+def bench_scales(names=("small", "medium"), latency=0, repeat=3):
+    """Run the end-to-end benchmarks on synthetic catalogs of each named scale."""
+    for name in names:
+        data = SyntheticData(**scales[name])
+        with stub_server(data, latency):
+            print("Fetching (%s):" % name)
+            print("\t".join(["Scale", "Data", "Pager workers", "Time (s)"]))
+            bench_fetch(data, name)
+            print("Comparing (%s):" % name)
+            print("\t".join(["Scale", "Games", "Dicts (s)", "Store (s)"]))
+            bench_compare(data, name, repeat=repeat)
+            print("Condorcet (%s):" % name)
+            bench_condorcet(data, name, repeat=repeat)
+            print("Play stats (%s):" % name)
+            bench_play_stats(data, name, repeat=repeat)
+
+
+def result_key(result):
+    """Get what identifies a benchmark across runs: its name and parameters."""
+    return json.dumps({k: v for k, v in result.items() if k not in ("seconds", "run", "commit")},
+                      sort_keys=True)
+
+
+def write_results(filename="bench_results.jsonl"):
+    """Append the results of this run to filename, tagged with the time and commit."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                                ).stdout.strip()
+    except OSError:
+        commit = ""
+    run = time.strftime("%Y-%m-%dT%H:%M:%S")
+    with open(filename, "a") as f:
+        for result in records:
+            f.write(json.dumps(dict(result, run=run, commit=commit)) + "\n")
+
+
+def compare_results(filename="bench_results.jsonl", threshold=1.2):
+    """
+    Print how the last run in filename compares to the previous run of each
+    benchmark, marking those more than threshold times slower.
+    """
+    try:
+        with open(filename) as f:
+            results = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return
+    if not results:
+        return
+
+    last_run = results[-1]["run"]
+    previous = {}
+    for result in results:
+        if result["run"] != last_run:
+            previous[result_key(result)] = result
+
+    print("Compared to previous runs:")
+    print("\t".join(["Benchmark", "Previous (s)", "Now (s)", "Ratio", "Previous commit"]))
+    for result in results:
+        old = previous.get(result_key(result))
+        if result["run"] != last_run or old is None:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("nan")
+        params = ", ".join("%s=%s" % item for item in sorted(result.items())
+                           if item[0] not in ("bench", "seconds", "run", "commit"))
+        print("%s(%s)\t%.4f\t%.4f\t%.2f%s\t%s"
+              % (result["bench"], params, old["seconds"], result["seconds"], ratio,
+                 " SLOWER" if ratio > threshold else "", old.get("commit", "")))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time hot paths on synthetic BoardGameGeek data.")
+    parser.add_argument("--scale", action="append", choices=list(scales),
+                        help="synthetic catalog size, may be repeated (default small and medium)")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds the stub server waits before each response")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repeats of each benchmark")
+    parser.add_argument("--output", default="bench_results.jsonl",
+                        help="file to append results to")
+    parser.add_argument("--skip-micro", action="store_true",
+                        help="skip the pairwise, ranking and parser benchmarks")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run benchmarks, print timings and record them to a results file."""
+    args = parse_args(argv)
+    if not args.skip_micro:
+        print("Pairwise engine scaling:")
+        print("\t".join(["Games", "Users", "Wins (s)", "Top rating (s)"]))
+        bench_pairwise(repeat=args.repeat)
+        print("Condorcet-IRV ranking:")
+        print("\t".join(["Games", "Rank (s)"]))
+        bench_ranking(repeat=args.repeat)
+        print("Parser backends:")
+        print("\t".join(["Response", "Backend", "Time per page (s)"]))
+        bench_parsers(repeat=args.repeat)
+    bench_scales(args.scale or ["small", "medium"], args.latency, args.repeat)
+
+    write_results(args.output)
+    compare_results(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+# Seconds a cached response is used without asking the server, by kind of
+# request. Ratings and plays pages are never used without asking, so they are
+# only kept when the cache records responses for offline replay.
+default_ttls = {
+    "search": 7 * 86400,
+    "thing": 7 * 86400,
+    "ratings": 0,
+    "plays": 0,
+    "browse": 86400,
+    "user": 30 * 86400,
+}
+
+
+class CacheMiss(LookupError):
+    """Raised in offline mode when a response has not been cached."""
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of HTTP response bodies, keyed by URL and query parameters.
+
+    Bodies are stored zlib-compressed, one file per response, with an index of
+    when each was fetched and last used and its ETag and Last-Modified headers.
+    Fresh responses are returned without a request, stale ones are revalidated
+    with a conditional request, and the least recently used responses are
+    evicted once the cache grows past max_bytes. In offline mode every cached
+    response is used regardless of age and nothing is requested.
+
+    Responses of kinds with no time to live are only stored with replay, to
+    be used offline later. Changes to the index are appended to a journal,
+    which is folded into index.json every journal_size changes and on flush.
+    """
+
+    journal_size = 1000
+
+    def __init__(self, path="http_cache", max_bytes=256 * 2 ** 20, ttls=None, offline=False,
+                 replay=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(default_ttls, **(ttls or {}))
+        self.offline = offline
+        self.replay = replay
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._index = None
+        self._size = 0
+        self._journaled = 0
+        self._dirty = False
+
+    @property
+    def index(self):
+        """Metadata of each cached response, loaded when first needed."""
+        if self._index is None:
+            try:
+                with open(self._file("index.json")) as f:
+                    self._index = json.load(f)
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                self._index = {}
+            self._replay_journal()
+            self._size = sum(entry["size"] for entry in self._index.values())
+        return self._index
+
+    def _replay_journal(self):
+        """Apply index changes journaled since index.json was last written."""
+        try:
+            with open(self._file("journal.jsonl")) as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        break
+                    if change.get("entry") is None:
+                        self._index.pop(change["key"], None)
+                    else:
+                        self._index[change["key"]] = change["entry"]
+                    self._journaled += 1
+        except FileNotFoundError:
+            pass
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @staticmethod
+    def key(url, params=None):
+        """Get the cache key of a request."""
+        query = urlencode(sorted((params or {}).items()))
+        return hashlib.sha1(("%s?%s" % (url, query)).encode("utf-8")).hexdigest()
+
+    def fetch(self, url, params, kind, request):
+        """
+        Get the body of a response, from the cache when possible.
+        Takes the URL and query parameters, the kind of request, which sets its
+        time to live, and a function that makes the request given a dict of
+        extra headers and returns a requests response.
+        """
+        key = self.key(url, params)
+        with self.lock:
+            entry = self.index.get(key)
+        body = self._read(key) if entry else None
+        now = time.time()
+
+        if body is not None and (self.offline or now - entry["time"] < self.ttls.get(kind, 0)):
+            self._touch(key, now)
+            self.hits += 1
+            return body
+        if self.offline:
+            raise CacheMiss("No cached response for %s %s" % (url, params or ""))
+
+        headers = {}
+        if body is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = request(headers)
+        except OSError:
+            # Serve a stale response rather than an error.
+            if body is not None:
+                return body
+            raise
+        if response.status_code == 304 and body is not None:
+            self._touch(key, now, validated=True)
+            self.revalidated += 1
+            return body
+        self.misses += 1
+        if response.status_code != 200:
+            # Serve a stale response rather than an error.
+            return body if body is not None else response.text
+
+        text = response.text
+        # The API reports errors in the body of a successful response.
+        if "<error" not in text[:500] and (self.replay or self.ttls.get(kind, 0) > 0):
+            self._store(key, url, kind, text, response.headers, now)
+        return text
+
+    def discard(self, url, params=None):
+        """Remove a cached response, such as one that turned out to be unusable."""
+        key = self.key(url, params)
+        with self.lock:
+            if key in self.index:
+                self._remove(key)
+
+    def _read(self, key):
+        try:
+            with open(self._file(key + ".z"), "rb") as f:
+                return zlib.decompress(f.read()).decode("utf-8")
+        except (FileNotFoundError, zlib.error):
+            return None
+
+    def _touch(self, key, now, validated=False):
+        with self.lock:
+            entry = self.index[key]
+            entry["access"] = now
+            if validated:
+                entry["time"] = now
+                self._journal(key, entry)
+            else:
+                self._dirty = True
+
+    def _store(self, key, url, kind, text, headers, now):
+        data = zlib.compress(text.encode("utf-8"))
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = self._file(key + ".z.tmp.%d" % threading.get_ident())
+            with open(tmp_file, "wb") as f:
+                f.write(data)
+            os.replace(tmp_file, self._file(key + ".z"))
+            old = self.index.get(key)
+            if old is not None:
+                self._size -= old["size"]
+            entry = self.index[key] = {
+                "url": url,
+                "kind": kind,
+                "time": now,
+                "access": now,
+                "size": len(data),
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+            }
+            self._size += len(data)
+            self._journal(key, entry)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Remove least recently used responses until the cache fits in 90% of
+        max_bytes, so that the index is only sorted once in a while.
+        """
+        for key in sorted(self.index, key=lambda key: self.index[key]["access"]):
+            if self._size <= 0.9 * self.max_bytes:
+                break
+            self._remove(key)
+
+    def _remove(self, key):
+        self._size -= self.index.pop(key)["size"]
+        self._journal(key, None)
+        try:
+            os.remove(self._file(key + ".z"))
+        except FileNotFoundError:
+            pass
+
+    def _journal(self, key, entry):
+        """Append a change to the index, or None for a removal, to the journal."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file("journal.jsonl"), "a") as f:
+            f.write(json.dumps({"key": key, "entry": entry}) + "\n")
+        self._journaled += 1
+        if self._journaled >= self.journal_size:
+            self._write_index()
+
+    def _write_index(self):
+        os.makedirs(self.path, exist_ok=True)
+        tmp_file = self._file("index.json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self._file("index.json"))
+        try:
+            os.remove(self._file("journal.jsonl"))
+        except FileNotFoundError:
+            pass
+        self._journaled = 0
+        self._dirty = False
+
+    def flush(self):
+        """Save access times of responses served from the cache and fold in the journal."""
+        with self.lock:
+            if self._dirty or self._journaled:
+                self._write_index()
+
+    def clear(self):
+        """Remove all cached responses."""
+        with self.lock:
+            for key in list(self.index):
+                try:
+                    os.remove(self._file(key + ".z"))
+                except FileNotFoundError:
+                    pass
+            self._index = {}
+            self._size = 0
+            if os.path.isdir(self.path):
+                self._write_index()
+
+    def report(self):
+        print("Response cache: %d hits, %d revalidated, %d downloaded"
+              % (self.hits, self.revalidated, self.misses))
@@ -0,0 +1,377 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from math import ceil
+
+import bgg_cache
+import bgg_compare
+import bgg_core
+import bgg_crawl
+import bgg_metrics
+import bgg_pairs
+import bgg_plays
+import bgg_sample
+import bgg_store
+import bgg_time
+
+
+@contextmanager
+def stage(name, timings):
+    """Time a stage of a job, printing the time taken."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+        print("Stage %s: %.2fs" % (name, timings[name]), file=sys.stderr)
+
+
+def read_ids(ids=(), files=()):
+    """
+    Get a list of game ids from arguments and files.
+    Files have one id per line, or CSV rows with the id in the first column.
+    Blank lines and lines starting with # are skipped.
+    """
+    ids = [str(game_id) for game_id in ids]
+    for filename in files:
+        with open(filename, newline="") as f:
+            for row in csv.reader(f):
+                if row and row[0].strip() and not row[0].startswith("#"):
+                    ids.append(row[0].strip())
+    return list(dict.fromkeys(ids))
+
+
+def top_ids(top, workers=4):
+    """Get ids of the top ranked games, downloading their ratings."""
+    pages = range(1, ceil(top / bgg_crawl.GAMES_PER_RANK_PAGE) + 1)
+    return [game_id for game_id, _ in bgg_crawl.crawl(pages, limit=top, workers=workers)]
+
+
+def fetch(ids, plays=False, update=False, workers=4):
+    """Download ratings, or plays, for games not yet downloaded."""
+    if plays:
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(lambda game_id: bgg_time.read_play_columns(game_id, update), ids))
+        return [{"id": game_id} for game_id in ids]
+
+    store = bgg_store.RatingStore()
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(lambda game_id: bgg_core.read_data(
+            game_id, "ratings", bgg_compare.get_ratings, update=update, store=store),
+            [game_id for game_id in ids if update or game_id not in store]))
+    counts = store.counts(ids)
+    return [{"id": game_id, "ratings": int(count)} for game_id, count in zip(ids, counts)]
+
+
+def refresh(plays=False, max_age=0, workers=4, compact=False):
+    """
+    Update all downloaded ratings, or plays, not synced in the last max_age seconds.
+    With compact, the rating store is compacted afterwards.
+    """
+    if plays:
+        updated = bgg_core.refresh_data("plays", bgg_time.get_plays, max_age, workers)
+    else:
+        store = bgg_store.RatingStore()
+        updated = bgg_core.refresh_data("ratings", bgg_compare.get_ratings, max_age, workers,
+                                        store)
+        if compact:
+            print("Compacting rating store, %.0f%% orphaned" % (100 * store.orphaned()))
+            store.compact()
+    return [{"id": game_id} for game_id in updated]
+
+
+def compare(ids, update=False):
+    """Compare average ratings among users who rated every game."""
+    avg_ratings = bgg_compare.compare_games(ids, update)
+    return [{"id": game_id, "avg_rating": float(avg_rating)}
+            for game_id, avg_rating in zip(ids, avg_ratings)]
+
+
+def rank(ids, methods=("condorcet_irv",), update=False, pairs_path="pairs"):
+    """Rank games with each of the given methods."""
+    store = bgg_compare.load_ratings(ids, update)
+    rankings = bgg_compare.rank_stored(store, ids, list(methods), pairs_path)
+    return [{"method": method, "rank": i, "id": game_id}
+            for method in methods for i, game_id in enumerate(rankings[method], 1)]
+
+
+def pairs(ids=(), update=False, rebuild=False, pairs_path="pairs"):
+    """
+    Build the head-to-head matrix of every stored game, and compare the given games.
+    Games added to the rating store since the matrix was built, or whose
+    ratings changed, are brought up to date, unless rebuild recomputes it from
+    scratch. Returns a row of head-to-head stats for each pair of the given
+    games.
+    """
+    store = bgg_compare.load_ratings(ids, update)
+    if rebuild:
+        matrix = bgg_pairs.compute_pairs(store, path=pairs_path)
+    else:
+        matrix = bgg_pairs.PairMatrix(pairs_path).update(store, list(store.games))
+    print("Pair matrix of %d games in %s" % (len(matrix), pairs_path))
+
+    return [{"id": a, "other": b, **matrix.head_to_head(a, b)}
+            for i, a in enumerate(ids) for b in ids[i + 1:]]
+
+
+def sample_compare(ids, confidence=0.95, max_fraction=1.0, seed=None, workers=4):
+    """
+    Compare average ratings among users who rated every game from a sample of
+    rating pages, with confidence intervals.
+    """
+    result = bgg_sample.sample_compare(ids, confidence, seed=seed, max_fraction=max_fraction,
+                                       workers=workers)
+    if not result["users"]:
+        raise ValueError("Zero common users between sampled ratings.")
+    print("Common users: %d, resolved: %s" % (result["users"], result["resolved"]))
+    return [{"id": game_id, "avg_rating": float(mean), "low": float(low), "high": float(high)}
+            for game_id, mean, low, high in zip(ids, result["means"], result["low"],
+                                                result["high"])]
+
+
+def sample_rank(ids, methods=("condorcet_irv",), confidence=0.95, max_fraction=1.0, seed=None,
+                workers=4):
+    """
+    Rank games with each method from a sample of rating pages, with the share
+    of users preferring each game to the next and its confidence interval.
+    """
+    result = bgg_sample.sample_rank(ids, methods, confidence, seed=seed,
+                                    max_fraction=max_fraction, workers=workers)
+    print("Resolved: %s" % result["resolved"])
+    rows = []
+    for method in methods:
+        ranked = result[method]
+        for i, game_id in enumerate(ranked["ranking"]):
+            row = {"method": method, "rank": i + 1, "id": game_id}
+            if i < len(ranked["share"]):
+                row.update(share_next=float(ranked["share"][i]), low=float(ranked["low"][i]),
+                           high=float(ranked["high"][i]))
+            rows.append(row)
+    return rows
+
+
+def stats(ids=(), players=None, workers=None, update=False, joined=False, resolve=False):
+    """
+    Get play stats and average ratings.
+    If no ids are given, stats for all downloaded games are returned. With
+    joined, ratings are related to the plays of the same users instead, with a
+    last row for all the games together. Filtering by number of players needs
+    ids and is not supported with joined.
+    """
+    if players and (joined or not ids):
+        raise ValueError("--players needs game ids and can't be combined with --joined")
+
+    if joined:
+        if ids:
+            for game_id in ids:
+                bgg_time.read_play_columns(game_id, update)
+            bgg_compare.load_ratings(ids, update)
+        joined_stats = bgg_plays.joined_stats(ids or None, workers, resolve)
+        return [{"id": game_id, **game_stats} for game_id, game_stats in joined_stats.items()]
+
+    if not ids:
+        all_ratings = bgg_compare.all_ratings(workers)
+        all_play_stats = bgg_time.all_play_stats(workers)
+        ids = sorted(set(all_ratings) & set(all_play_stats), key=lambda id: (len(id), id))
+        return [{"id": game_id, **all_ratings[game_id], **all_play_stats[game_id]}
+                for game_id in ids]
+
+    rows = []
+    for game_id in ids:
+        game_stats = bgg_time.play_stats(game_id, players, update=update)
+        game_stats["avg_rating"] = bgg_compare.average_rating(game_id)
+        rows.append({"id": game_id, **game_stats})
+    return rows
+
+
+def add_names(rows):
+    """Add game names to rows with a game id, and of the other game of pair rows."""
+    ids = [row[key] for row in rows for key in ("id", "other") if key in row]
+    names = bgg_core.get_game_names(list(dict.fromkeys(game_id for game_id in ids
+                                                       if game_id != "all")))
+    names["all"] = "All games"
+    for row in rows:
+        row["name"] = names.get(row["id"], "")
+        if "other" in row:
+            row["other_name"] = names.get(row["other"], "")
+    return rows
+
+
+def write_rows(rows, fmt="table", output=None):
+    """Write rows as a tab-separated table, CSV or JSON, to output or stdout."""
+    f = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if fmt == "json":
+            json.dump(rows, f, indent=2)
+            f.write("\n")
+            return
+        fields = list(dict.fromkeys(field for row in rows for field in row))
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            f.write("\t".join(fields) + "\n")
+            for row in rows:
+                f.write("\t".join(str(row.get(field, "")) for field in fields) + "\n")
+    finally:
+        if output:
+            f.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run BoardGameGeek jobs without prompts.")
+    parser.add_argument("--format", choices=["table", "csv", "json"], default="table",
+                        help="output format")
+    parser.add_argument("--output", help="file to write results to instead of stdout")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="number of concurrent downloads or processes")
+    parser.add_argument("--pager-workers", type=int, default=bgg_core.pager_workers,
+                        help="number of pages of one game to fetch concurrently")
+    parser.add_argument("--no-names", action="store_true", help="do not look up game names")
+    parser.add_argument("--metrics", help="file to append request and page metrics to")
+    parser.add_argument("--offline", action="store_true",
+                        help="only use cached responses, without the network")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always download instead of using cached responses")
+    parser.add_argument("--record", action="store_true",
+                        help="cache ratings and plays pages too, for later --offline runs")
+    parser.add_argument("--full", action="store_true",
+                        help="when updating ratings, fetch every page even if the total "
+                             "is unchanged")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_games(subparser):
+        subparser.add_argument("ids", nargs="*", help="game ids")
+        subparser.add_argument("--file", action="append", default=[],
+                               help="file of game ids, one per line")
+        subparser.add_argument("--top", type=int, help="use the top ranked games")
+        subparser.add_argument("--update", action="store_true",
+                               help="update downloaded data")
+
+    fetch_parser = subparsers.add_parser("fetch", help="download ratings or plays")
+    add_games(fetch_parser)
+    fetch_parser.add_argument("--plays", action="store_true",
+                              help="download plays instead of ratings")
+
+    refresh_parser = subparsers.add_parser("refresh", help="update downloaded data")
+    refresh_parser.add_argument("--plays", action="store_true",
+                                help="update plays instead of ratings")
+    refresh_parser.add_argument("--max-age", type=float, default=0,
+                                help="only update data not synced in this many seconds")
+    refresh_parser.add_argument("--compact", action="store_true",
+                                help="drop ratings replaced by updates from the rating store; "
+                                     "nothing else should have it open")
+
+    def add_sample(subparser):
+        subparser.add_argument("--sample", action="store_true",
+                               help="sample rating pages until the order is resolved")
+        subparser.add_argument("--confidence", type=float, default=0.95,
+                               help="confidence level of sampled intervals")
+        subparser.add_argument("--max-fraction", type=float, default=1.0,
+                               help="largest fraction of rating pages to sample")
+        subparser.add_argument("--seed", type=int, help="random seed for sampling")
+
+    compare_parser = subparsers.add_parser("compare", help="compare ratings among common users")
+    add_games(compare_parser)
+    add_sample(compare_parser)
+
+    rank_parser = subparsers.add_parser("rank", help="rank games from pairwise comparisons")
+    add_games(rank_parser)
+    add_sample(rank_parser)
+    rank_parser.add_argument("--method", action="append",
+                             choices=["condorcet_irv"] + list(bgg_compare.RANKING_ENGINES),
+                             help="ranking method, may be repeated (default condorcet_irv)")
+    rank_parser.add_argument("--pairs", default="pairs", help="pair matrix directory")
+
+    pairs_parser = subparsers.add_parser("pairs",
+                                         help="build the head-to-head matrix of all stored "
+                                              "games and compare the given games")
+    add_games(pairs_parser)
+    pairs_parser.add_argument("--rebuild", action="store_true",
+                              help="recompute the matrix from scratch")
+    pairs_parser.add_argument("--pairs", default="pairs", help="pair matrix directory")
+
+    stats_parser = subparsers.add_parser("stats", help="play stats and average ratings")
+    add_games(stats_parser)
+    stats_parser.add_argument("--players", type=int, help="only count plays with this many players")
+    stats_parser.add_argument("--joined", action="store_true",
+                              help="relate ratings to plays of the same users")
+    stats_parser.add_argument("--resolve-users", action="store_true",
+                              help="look up usernames of players not seen before")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run a job from command line arguments and write its results."""
+    args = parse_args(argv)
+    bgg_core.pager_workers = args.pager_workers
+    if args.full:
+        bgg_compare.full_refresh_days = 0
+    bgg_metrics.log_file = args.metrics
+    bgg_metrics.reset()
+    if args.no_cache:
+        bgg_core.response_cache = None
+    else:
+        bgg_core.response_cache.offline = args.offline
+        bgg_core.response_cache.replay = args.record
+    timings = {}
+
+    # Keep progress messages out of results written to stdout.
+    with redirect_stdout(sys.stderr):
+        ids = []
+        if args.command != "refresh":
+            ids = read_ids(args.ids, args.file)
+            if args.top:
+                with stage("crawl", timings):
+                    ids += [game_id for game_id in top_ids(args.top, args.workers)
+                            if game_id not in ids]
+            if not ids and args.command not in ("stats", "pairs"):
+                sys.exit("No game ids given.")
+
+        try:
+            with stage(args.command, timings):
+                if args.command == "fetch":
+                    rows = fetch(ids, args.plays, args.update, args.workers)
+                elif args.command == "refresh":
+                    rows = refresh(args.plays, args.max_age, args.workers, args.compact)
+                elif args.command == "compare" and args.sample:
+                    rows = sample_compare(ids, args.confidence, args.max_fraction, args.seed,
+                                          args.workers)
+                elif args.command == "compare":
+                    rows = compare(ids, args.update)
+                elif args.command == "rank" and args.sample:
+                    rows = sample_rank(ids, args.method or ["condorcet_irv"], args.confidence,
+                                       args.max_fraction, args.seed, args.workers)
+                elif args.command == "rank":
+                    rows = rank(ids, args.method or ["condorcet_irv"], args.update, args.pairs)
+                elif args.command == "pairs":
+                    rows = pairs(ids, args.update, args.rebuild, args.pairs)
+                else:
+                    rows = stats(ids, args.players, args.workers, args.update, args.joined,
+                                 args.resolve_users)
+        except (ValueError, bgg_cache.CacheMiss, bgg_core.APIError) as e:
+            sys.exit("Error: %s" % e)
+
+        if rows and not args.no_names:
+            with stage("names", timings):
+                add_names(rows)
+
+    with stage("output", timings):
+        write_rows(rows, args.format, args.output)
+
+    with redirect_stdout(sys.stderr):
+        if bgg_core.response_cache is not None:
+            bgg_core.response_cache.report()
+        bgg_metrics.report()
+    print("Total: %.2fs" % sum(timings.values()), file=sys.stderr)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,68 @@
+import asyncio
 import glob
 import os
+import time
 import numpy as np
-import numpy.ma as ma
 
+import bgg_async
 import bgg_core
+import bgg_pairs
+import bgg_parse
+import bgg_store
 
+# Days after which updating a game's ratings fetches every page again, rather
+# than stopping after the first page when the total is unchanged.
+full_refresh_days = 30
 
-def get_ratings(id):
-    """Get ratings for game with given id."""
+
+def get_ratings(id, sync=None):
+    """
+    Get ratings for game with given id.
+    If a sync dict is given, it is updated with the total number of ratings
+    and the page being yielded, and sync["next_page"] resumes from a later
+    page. Rating comments are not ordered by when they were made, so changes
+    can be on any page. When updating, only the first page is fetched if the
+    total matches sync["last_total"] and every page was fetched less than
+    full_refresh_days ago; otherwise every page is fetched, and the time is
+    kept in sync["full_time"].
+    """
 
     query_dict = {"id": id, "ratingcomments": 1, "pagesize": 100}
-    ratings = {}
+    if sync is None:
+        sync = {}
+    quick = (sync.get("last_total") is not None
+             and time.time() - sync.get("full_time", 0) < full_refresh_days * 24 * 3600)
+    start = time.time()
 
-    for page, soup in bgg_core.pager("thing", query_dict, 3):
+    for page, (total, ratings) in bgg_core.pager("thing", query_dict, 3,
+                                                 parse=bgg_parse.parse_ratings,
+                                                 first_page=sync.get("next_page", 1)):
 
-        tags = soup.find_all("comment")
-        if not tags:
+        if total is not None:
+            sync["total"] = total
+        sync["page"] = page - 1
+
+        if not ratings:
             break
-        for tag in tags:
-            yield tag["username"] , tag["rating"]
+        yield from ratings
 
         print("Parsed ratings page %s for game id %s" % (page, id))
+        if quick and total == sync["last_total"]:
+            return
+
+    if sync.get("next_page", 1) == 1:
+        sync["full_time"] = start
+
+
+def load_ratings(ids, update=False):
+    """Open the rating store, downloading ratings for games not yet stored."""
+
+    store = bgg_store.RatingStore()
+    for game_id in ids:
+        if update or game_id not in store:
+            bgg_core.read_data(game_id, "ratings", get_ratings, update=update, store=store)
+
+    return store
 
 
 def compare_ratings(ratings_list):
@@ -30,123 +72,495 @@ def compare_ratings(ratings_list):
     Returns a list of average ratings among common users between all lists.
     """
 
-    avg_ratings = []
-    all_users = [list(r.keys()) for r in ratings_list]
+    return compare_matrix(user_game_matrix(ratings_list))
+
 
-    common_users = set.intersection(*map(set, all_users))
-    num_common_users = len(common_users)
+def compare_stored_ratings(store, ids):
+    """
+    Compare ratings among common users.
+    Takes a rating store and a list of game ids.
+    Returns a list of average ratings among common users between all games.
+    """
+
+    return compare_matrix(store.common_ratings(ids)[1])
+
+
+def compare_games(ids, update=False):
+    """
+    Compare ratings among common users.
+    Takes a list of game ids, downloading ratings for games not yet stored.
+    Returns a list of average ratings among common users between all games.
+    """
+
+    return compare_stored_ratings(load_ratings(ids, update), ids)
+
+
+def compare_matrix(user_game_mat):
+    """
+    Compare ratings among common users.
+    Takes a games x users matrix of ratings, with NaN for missing ratings.
+    Returns a list of average ratings among users who rated every game.
+    """
+
+    common_users = ~np.any(np.isnan(user_game_mat), axis=0)
+    num_common_users = np.count_nonzero(common_users)
     if not num_common_users:
         raise ValueError("Zero common users between games.")
     print("Ratings: %s" % num_common_users)
 
-    for ratings_dict in ratings_list:
-        rating = sum(float(r) for u, r in ratings_dict.items()
-                     if u in common_users)/num_common_users
-        avg_ratings.append(rating)
+    return list(np.mean(user_game_mat[:, common_users], axis=1, dtype=np.float64))
+
+
+def user_game_matrix(ratings_list):
+    """
+    Build a games x users matrix of ratings.
+    Takes a list of dicts with user-rating as key-value pairs.
+    Users who did not rate a game get NaN in that game's row.
+    """
 
-    return avg_ratings
+    users = {}
+    for ratings in ratings_list:
+        for user in ratings:
+            users.setdefault(user, len(users))
+
+    user_game_mat = np.full((len(ratings_list), len(users)), np.nan)
+    for i, ratings in enumerate(ratings_list):
+        cols = np.fromiter((users[u] for u in ratings), dtype=np.intp, count=len(ratings))
+        user_game_mat[i, cols] = np.array(list(ratings.values()), dtype=float)
 
+    return user_game_mat
 
-def condorcet_irv(ratings_list, ids):
+
+def pairwise_wins(user_game_mat, max_cells=2 ** 24):
+    """
+    Count pairwise wins between all games.
+    Takes a games x users matrix of ratings, with NaN for missing ratings.
+    Returns a games x games matrix where entry [i, j] is the number of users who
+    rated game i higher than game j. Users are processed in chunks so that no
+    intermediate comparison array exceeds max_cells elements.
+    """
+
+    num_games, num_users = user_game_mat.shape
+    chunk_size = max(1, max_cells // max(1, num_games ** 2))
+    wins = np.zeros((num_games, num_games), dtype=np.int64)
+
+    for start in range(0, num_users, chunk_size):
+        chunk = user_game_mat[:, start:start + chunk_size]
+        # NaN never compares greater, so missing ratings never count as a win.
+        wins += np.count_nonzero(chunk[:, None, :] > chunk[None, :, :], axis=2)
+
+    return wins
+
+
+def top_rating_counts(user_game_mat, max_cells=2 ** 24):
+    """
+    Count how many times each game was a user's top rated game.
+    Takes a games x users matrix of ratings, with NaN for missing ratings.
+    """
+
+    num_games, num_users = user_game_mat.shape
+    chunk_size = max(1, max_cells // max(1, num_games))
+    counts = np.zeros((num_games,), dtype=np.int64)
+
+    for start in range(0, num_users, chunk_size):
+        chunk = user_game_mat[:, start:start + chunk_size]
+        counts += np.count_nonzero(chunk == np.max(chunk, 0), axis=1)
+
+    return counts
+
+
+def user_major_ratings(ratings_list):
+    """
+    Flatten ratings into arrays sorted by user.
+    Takes a list of dicts with user-rating as key-value pairs.
+    Returns arrays of integer user ids, positions of games in the list and
+    ratings.
+    """
+
+    user_ids = {}
+    users = []
+    for ratings in ratings_list:
+        users.append(np.fromiter((user_ids.setdefault(u, len(user_ids)) for u in ratings),
+                                 dtype=np.int32, count=len(ratings)))
+    users = np.concatenate(users or [np.zeros((0,), dtype=np.int32)])
+    games = np.repeat(np.arange(len(ratings_list), dtype=np.int32),
+                      [len(ratings) for ratings in ratings_list])
+    ratings = np.concatenate([np.array(list(ratings.values()), dtype=float)
+                              for ratings in ratings_list] or [np.zeros((0,))])
+
+    # Rows are concatenated in game order, so a stable sort keeps it per user.
+    order = np.argsort(users, kind="stable")
+    users = users[order]
+    games = games[order]
+    ratings = ratings[order]
+    return users, games, ratings
+
+
+def pairwise_counts_streamed(users, games, ratings, num_games, max_memory=2 ** 28):
+    """
+    Count pairwise wins and top ratings from ratings sorted by user.
+    Takes arrays of user ids, game positions and ratings, as returned by
+    user_major_ratings or RatingStore.by_user. Users are processed in blocks,
+    each expanded into a dense games x users matrix, so that the block and the
+    comparisons made on it stay within about max_memory bytes.
+    Returns the pairwise wins matrix and top rating counts.
+    """
+
+    # Split memory between the float64 block and boolean comparison arrays.
+    max_cells = max(1, max_memory // 2)
+    block_size = max(1, max_cells // (8 * max(1, num_games)))
+
+    wins = np.zeros((num_games, num_games), dtype=np.int64)
+    top_ratings = np.zeros((num_games,), dtype=np.int64)
+    if not len(users):
+        return wins, top_ratings
+
+    # Dense index of each rating's user.
+    user_index = np.concatenate(([0], np.cumsum(users[1:] != users[:-1])))
+    num_users = int(user_index[-1]) + 1
+
+    for block_start in range(0, num_users, block_size):
+        lo, hi = np.searchsorted(user_index, [block_start, block_start + block_size])
+        block = np.full((num_games, min(block_size, num_users - block_start)), np.nan)
+        block[games[lo:hi], user_index[lo:hi] - block_start] = ratings[lo:hi]
+        wins += pairwise_wins(block, max_cells)
+        top_ratings += top_rating_counts(block, max_cells)
+
+    return wins, top_ratings
+
+
+def top_rating_counts_stored(store, ids):
+    """
+    Count how many times each game was a user's top rated game.
+    Takes a rating store and a list of game ids. As with a dense matrix, only
+    users who rated every game are counted.
+    """
+
+    users, games, ratings = store.by_user(ids)
+    if not len(users):
+        return np.zeros((len(ids),), dtype=np.int64)
+
+    starts = np.flatnonzero(np.concatenate(([True], users[1:] != users[:-1])))
+    sizes = np.diff(np.append(starts, len(users)))
+    top = ratings == np.repeat(np.maximum.reduceat(ratings, starts), sizes)
+    top &= np.repeat(sizes == len(ids), sizes)
+    return np.bincount(games[top], minlength=len(ids))
+
+
+def condorcet_irv(ratings_list, ids, max_memory=None):
     """
     Rank games by condorcet method.
     Takes a list of dicts with user-rating as key-value pairs and a list of game ids.
-    Returns a list of average ratings among common users between all lists.
+    If max_memory is given, users are streamed in blocks so that working
+    arrays stay within about that many bytes instead of building a dense games
+    x users matrix.
+    Returns a list of game ids in ranked order.
     """
 
-    num_games = len(ratings_list)
-    users = list({user for u in ratings_list for user in list(u.keys())})
-    ranks = []
+    votes = [len(ratings) for ratings in ratings_list]
+    if max_memory is None:
+        return condorcet_irv_matrix(user_game_matrix(ratings_list), votes, ids)
 
-    # Get info for IRV tiebreaker.
-    irv = np.zeros((num_games,), dtype=[("top_rating", "<i4"), ("votes", "<i4"),
-                                        ("year", "<i4"), ("id", "<i4")])
-    game_info = bgg_core.get_game_info(ids)
-    for i, info in enumerate(game_info):
-        irv[i]["year"] = info.find("yearpublished")["value"]
-        irv[i]["id"] = int(ids[i])
+    users, games, ratings = user_major_ratings(ratings_list)
+    cond_mat, top_ratings = pairwise_counts_streamed(users, games, ratings, len(ids),
+                                                     max_memory)
+    return condorcet_irv_rank(cond_mat, top_ratings, votes, ids)
 
-    # Create matrix of all games/users.
-    user_game_mat = np.zeros((num_games, len(users)))
-    for i, ratings in enumerate(ratings_list):
-        irv[i]["votes"] = len(ratings)
-        for j, user in enumerate(users):
-            user_game_mat[i, j] = ratings.get(user, np.nan)
+
+def condorcet_irv_stored(store, ids, pairs_path="pairs"):
+    """
+    Rank games by condorcet method.
+    Takes a rating store and a list of game ids. Pairwise wins are read from a
+    persisted pair matrix, which only computes stats for games that are new
+    or whose ratings changed since it was last updated.
+    Returns a list of game ids in ranked order.
+    """
+
+    return rank_stored(store, ids, ["condorcet_irv"], pairs_path)["condorcet_irv"]
+
+
+def condorcet_irv_matrix(user_game_mat, votes, ids):
+    """
+    Rank games by condorcet method.
+    Takes a games x users matrix of ratings, with NaN for missing ratings, the
+    number of ratings for each game and a list of game ids.
+    Returns a list of game ids in ranked order.
+    """
 
     # Generate matrix showing how many times game was favored in pairwise comparison.
-    cond_mat = np.apply_along_axis(lambda x: np.apply_along_axis(np.sum, 1, x > user_game_mat),
-                                   1, user_game_mat)
+    cond_mat = pairwise_wins(user_game_mat)
 
     # For IRV tiebreaker, how many times game was a user's top ranked game.
-    top_ratings = np.max(user_game_mat, 0)
-    irv[:]["top_rating"] = np.apply_along_axis(lambda x: np.sum(top_ratings == x),
-                                               1, user_game_mat)
+    top_ratings = top_rating_counts(user_game_mat)
+
+    return condorcet_irv_rank(cond_mat, top_ratings, votes, ids)
+
+
+def condorcet_irv_rank(cond_mat, top_ratings, votes, ids, years=None):
+    """
+    Rank games by condorcet method.
+    Takes a games x games matrix of pairwise wins, the number of times each
+    game was a user's top rated game, the number of ratings for each game and
+    a list of game ids. Years published are looked up unless given.
+    Returns a list of game ids in ranked order.
+    """
+
+    num_games = len(ids)
+    ranks = []
 
-    # Subtract columns from rows to show pairwise difference between games.
-    diff_mat = cond_mat - cond_mat.T
-    np.fill_diagonal(diff_mat, 1)
+    # Get info for IRV tiebreaker.
+    irv = np.zeros((num_games,), dtype=[("top_rating", "<i4"), ("votes", "<i4"),
+                                        ("year", "<i4"), ("id", "<i4")])
+    if years is None:
+        game_info = bgg_core.get_games_info(ids)
+        years = [game_info[game_id]["year"] for game_id in ids]
+    irv[:]["year"] = years
+    irv[:]["id"] = [int(game_id) for game_id in ids]
+    irv[:]["votes"] = votes
+    irv[:]["top_rating"] = top_ratings
 
     # Get tiebreak order, inverting years and ids for uniform sort order.
-    max_year = np.max(irv[:]["year"])
-    irv[:]["year"] = max_year - irv[:]["year"]
-    max_id = np.max(irv[:]["id"])
-    irv[:]["id"] = max_id - irv[:]["id"]
+    irv[:]["year"] = np.max(irv[:]["year"]) - irv[:]["year"]
+    irv[:]["id"] = np.max(irv[:]["id"]) - irv[:]["id"]
+    # Games in the order IRV removes plurality losers.
+    tiebreak = np.argsort(irv, order=("top_rating", "votes", "year", "id"))
+
+    # Position of each game in the tiebreak order.
+    position = np.empty((num_games,), dtype=np.intp)
+    position[tiebreak] = np.arange(num_games)
+
+    # Games not favored over each other game in pairwise comparison, with
+    # columns in tiebreak order.
+    unbeaten = ~(cond_mat > cond_mat.T)[:, tiebreak]
+    unbeaten[np.arange(num_games), position] = False
+    unranked = np.ones((num_games,), dtype=bool)
+
+    # Each IRV round starts from all unranked games and removes plurality losers
+    # in tiebreak order until one game beats every other remaining game. A game
+    # wins once the last unranked game it does not beat in tiebreak order has
+    # been removed, as long as it has not been removed itself, so the round
+    # winner is the game that needs the fewest removals.
+    need = last_true(unbeaten)
 
     # Rank by condorcet-IRV method.
-    while len(irv):
-        # Create masked array copies to hide tiebreak losers.
-        masked_mat = ma.masked_array(diff_mat)
-        masked_irv = ma.masked_array(irv)
-        # Find condorcet winner.
-        winners = []
-        while not len(winners):
-            # Winning rows are all positive.
-            winners = ma.where(ma.all(masked_mat > 0, axis=1))[0]
-            assert len(winners) <= 1, "multiple winners found"
-            if len(winners):
-                temp_id = irv[winners]["id"][0]
-                game_id = -(temp_id - max_id)  # Convert back to original id.
-                ranks.append(str(game_id))
-                diff_mat = np.delete(diff_mat, winners, axis=0)
-                diff_mat = np.delete(diff_mat, winners, axis=1)
-                irv = np.delete(irv, winners)
-            else:
-                # Remove plurality loser.
-                tiebreak = np.argsort(masked_irv, order=("top_rating", "votes",
-                                                         "year", "id"))
-                loser = tiebreak[0]
-                masked_irv[loser] = ma.masked
-                masked_mat[loser, :] = ma.masked
-                masked_mat[:, loser] = ma.masked
+    while len(ranks) < num_games:
+        candidates = np.flatnonzero(unranked[position] & (need < position))
+        winners = candidates[need[candidates] == np.min(need[candidates])]
+        assert len(winners) == 1, "multiple winners found"
+
+        winner = winners[0]
+        ranks.append(str(ids[winner]))
+        last = position[winner]
+        unranked[last] = False
+
+        # Only games whose last unbeaten game was the winner need updating.
+        affected = np.flatnonzero((need == last) & unranked[position])
+        need[affected] = last_true(unbeaten[affected, :last] & unranked[:last])
 
     return ranks
 
 
-def all_ratings():
-    """Get all downloaded ratings."""
-    games_dict = {}
-    for f in glob.glob("ratings/*.json"):
-        game_id = os.path.basename(os.path.splitext(f)[0])
-        ratings = bgg_core.read_data(game_id, "ratings", get_ratings)
-        sum_rating = sum(float(r) for r in ratings.values())
-        avg_rating = sum_rating / len(ratings)
-        games_dict[game_id] = {"avg_rating": avg_rating}
-    return games_dict
+def last_true(mask):
+    """Get the index of the last True value in each row of mask, or -1 if none."""
+    num_rows, num_cols = mask.shape
+    if not num_cols:
+        return np.full((num_rows,), -1, dtype=np.intp)
+    last = num_cols - 1 - np.argmax(mask[:, ::-1], axis=1)
+    return np.where(np.any(mask, axis=1), last, -1)
+
+
+def copeland_scores(wins, ties=None):
+    """
+    Score games by Copeland's method.
+    A game gets one point for each game it beats in pairwise comparison and
+    half a point for each game it draws with.
+    """
+
+    margins = wins - wins.T
+    draws = np.count_nonzero(margins == 0, axis=1) - 1
+    return np.count_nonzero(margins > 0, axis=1) + 0.5 * draws
+
+
+def schulze_scores(wins, ties=None):
+    """
+    Score games by the Schulze method.
+    Path strengths are the widest paths through pairwise wins, and a game
+    scores the number of games it has a stronger path to than from.
+    """
+
+    strength = np.where(wins > wins.T, wins, 0)
+    np.fill_diagonal(strength, 0)
+    for k in range(len(wins)):
+        np.maximum(strength, np.minimum(strength[:, k, None], strength[None, k, :]),
+                   out=strength)
+    return np.count_nonzero(strength > strength.T, axis=1)
+
+
+def ranked_pairs_scores(wins, ties=None):
+    """
+    Score games by Tideman's ranked pairs method.
+    Pairwise victories are locked in from the largest number of winning votes
+    down, skipping any that would create a cycle, and a game scores the number
+    of games it is locked above.
+    """
+
+    num_games = len(wins)
+    winners, losers = np.nonzero(wins > wins.T)
+    # Largest winning votes first, then the smallest opposing votes.
+    order = np.lexsort((wins[losers, winners], -wins[winners, losers]))
+
+    above = np.eye(num_games, dtype=bool)
+    for i, j in zip(winners[order], losers[order]):
+        if above[i, j] or above[j, i]:
+            continue
+        # Everything above i is now above everything below j.
+        above[above[:, i]] |= above[j]
+
+    return np.count_nonzero(above, axis=1) - 1
+
+
+def kemeny_scores(wins, ties=None):
+    """
+    Score games by an approximate Kemeny ranking.
+    Starting from the Borda order, each game is moved to the position that
+    agrees with the most pairwise preferences, until no move improves the
+    ranking. Scores are reversed positions.
+    """
+
+    margins = wins - wins.T
+    order = np.argsort(-np.sum(margins, axis=1), kind="stable")
+    improved = True
+    while improved:
+        improved = False
+        for game in list(order):
+            position = int(np.flatnonzero(order == game)[0])
+            rest = order[order != game]
+            # Agreement from placing the game before each position of the rest.
+            agreement = np.append(np.cumsum(margins[game, rest][::-1])[::-1], 0)
+            best = int(np.argmax(agreement))
+            if agreement[best] > agreement[position]:
+                order = np.insert(rest, best, game)
+                improved = True
+
+    scores = np.empty((len(order),), dtype=np.int64)
+    scores[order] = np.arange(len(order), 0, -1)
+    return scores
+
+
+def bradley_terry_scores(wins, ties=None, max_iter=1000, tol=1e-9):
+    """
+    Score games by a Bradley-Terry model fit to pairwise wins.
+    Ties between users' ratings count as half a win for each game. Strengths
+    are fit by minorization-maximization and normalized to sum to one.
+    """
+
+    wins = wins.astype(float)
+    if ties is not None:
+        wins = wins + 0.5 * ties
+        np.fill_diagonal(wins, 0)
+    games_played = wins + wins.T
+    total_wins = np.sum(wins, axis=1)
+
+    strength = np.full((len(wins),), 1.0 / max(1, len(wins)))
+    for _ in range(max_iter):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            denom = np.nansum(games_played / (strength[:, None] + strength[None, :]), axis=1)
+            new_strength = np.where(denom > 0, total_wins / denom, 0)
+        new_strength /= np.sum(new_strength) or 1
+        if np.max(np.abs(new_strength - strength)) < tol:
+            return new_strength
+        strength = new_strength
+
+    return strength
+
+
+# Ranking methods that score games from pairwise win and tie counts.
+RANKING_ENGINES = {
+    "copeland": copeland_scores,
+    "schulze": schulze_scores,
+    "ranked_pairs": ranked_pairs_scores,
+    "kemeny": kemeny_scores,
+    "bradley_terry": bradley_terry_scores,
+}
+
+
+def rank_pairwise(wins, ids, method="schulze", ties=None):
+    """
+    Rank games with one of the ranking engines.
+    Takes a games x games matrix of pairwise wins, a list of game ids, the name
+    of a method in RANKING_ENGINES and optionally a matrix of tied ratings.
+    Returns a list of game ids in ranked order, keeping the order of ids
+    between games with equal scores.
+    """
+
+    scores = RANKING_ENGINES[method](wins, ties)
+    return [str(ids[i]) for i in np.argsort(-scores, kind="stable")]
+
+
+def rank_stored(store, ids, methods=None, pairs_path="pairs"):
+    """
+    Rank games with several methods from one pair matrix.
+    Takes a rating store, a list of game ids and a list of method names,
+    defaulting to condorcet_irv followed by every engine in RANKING_ENGINES.
+    Returns a dict of method-ranking pairs.
+    """
+
+    if methods is None:
+        methods = ["condorcet_irv"] + list(RANKING_ENGINES)
+
+    pairs = bgg_pairs.PairMatrix(pairs_path).update(store, ids)
+    wins = pairs.submatrix("wins", ids).astype(np.int64)
+    ties = pairs.submatrix("ties", ids).astype(np.int64)
+
+    rankings = {}
+    for method in methods:
+        if method == "condorcet_irv":
+            top_ratings = top_rating_counts_stored(store, ids)
+            rankings[method] = condorcet_irv_rank(wins, top_ratings, store.counts(ids), ids)
+        else:
+            rankings[method] = rank_pairwise(wins, ids, method, ties)
+
+    return rankings
+
+
+def average_rating(game_id):
+    """Get average rating for a game, streaming its downloaded ratings."""
+    sum_rating = 0
+    num_ratings = 0
+    for user, rating in bgg_core.iter_data(game_id, "ratings", get_ratings):
+        sum_rating += float(rating)
+        num_ratings += 1
+    return sum_rating / num_ratings
+
+
+def all_ratings(workers=None):
+    """
+    Get all downloaded ratings.
+    Averages are cached until a game's ratings file changes. Games in the
+    rating store are averaged from it, and the rest are read on a pool of
+    worker processes.
+    """
+    ids = bgg_core.downloaded_ids("ratings")
+    store = bgg_store.RatingStore()
+
+    with bgg_core.SummaryCache("ratings_summary.json", "ratings") as cache:
+        stale = cache.stale(ids)
+        stored = [game_id for game_id in stale if game_id in store]
+        unstored = [game_id for game_id in stale if game_id not in store]
+        cache.update(dict(zip(stored, store.averages(stored))))
+        cache.update(dict(zip(unstored, bgg_core.map_games(average_rating, unstored, workers))))
+        cache.report()
+        avg_ratings = {game_id: cache[game_id] for game_id in ids}
+
+    return {game_id: {"avg_rating": avg_ratings[game_id]} for game_id in ids}
 
 
 def main():
     """Compare ratings between users who have rated all games of interest."""
 
-    # Ask for games to compare.
-    games = []
-    more_games = True
-
-    while more_games:
-        try:
-            games.append(bgg_core.select_game())
-        # Stop search if no input.
-        except ValueError:
-            more_games = False
+    # Ask for games to compare, downloading ratings in the background.
+    store = bgg_store.RatingStore()
+    games = asyncio.run(bgg_async.select_games("ratings", get_ratings, store))
 
     # If no games entered, compare all downloaded ratings.
     if not games:
@@ -154,24 +568,15 @@ def main():
         for f in glob.glob("games/*.json"):
             id = os.path.basename(os.path.splitext(f)[0])
             ids.append(id)
-        game_info = bgg_core.get_game_info(ids)
-        for i, info in enumerate(game_info):
-            name = info.find("name", attrs={"type": "primary"})["value"]
-            games.append((ids[i], name))
+        names = bgg_core.get_game_names(ids)
+        games = [(id, names[id]) for id in ids]
 
     print("Comparing games:")
 
-    all_ratings = []
-
     for game_id, name in games:
-
         print(name)
 
-        ratings = bgg_core.read_data(game_id, "ratings", get_ratings)
-
-        all_ratings.append(ratings)
-
-    avg_ratings = compare_ratings(all_ratings)
+    avg_ratings = compare_games([game_id for game_id, name in games])
 
     for i, game in enumerate(games):
         print("Average rating for %s: %.2f" % (game[1], avg_ratings[i]))
@@ -1,47 +1,170 @@
+import atexit
+import collections
+import glob
 import json
 import os
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import requests
 import retry
 from bs4 import BeautifulSoup
 
-base_url = "https://www.boardgamegeek.com/xmlapi2"
-
-
-def pager(data="thing", query_dict={}, max_retry=1):
-    page = 1
-    retries = 0
+import bgg_cache
+import bgg_metrics
+import bgg_parse
 
-    while retries < max_retry:
+base_url = "https://www.boardgamegeek.com/xmlapi2"
 
+# Number of pages pager fetches concurrently.
+pager_workers = 1
+# Attempts and initial delay in seconds when the API answers 202 or 429.
+throttle_retries = 6
+throttle_delay = 2
+
+
+class APIError(OSError):
+    """Raised when the API answers a request with an error status."""
+
+
+class ThrottledError(APIError):
+    """Raised when the API is still throttling or queueing a request after every retry."""
+
+
+class RateLimiter(object):
+    """Token bucket limiting the rate of requests across threads."""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                wait = self.paused_until - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(wait, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def backoff(self, delay):
+        """Pause all requests for delay seconds."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.tokens = 0
+
+
+session = requests.Session()
+session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=16))
+session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=16))
+# Maximum sustained API requests per second, shared by all threads.
+limiter = RateLimiter(4)
+# On-disk cache of responses, or None to always download. Set
+# response_cache.offline to replay cached responses without the network.
+response_cache = bgg_cache.ResponseCache()
+atexit.register(lambda: response_cache and response_cache.flush())
+
+
+def cached_get(url, params, kind, request):
+    """Get response text through the response cache, if any."""
+    if response_cache is None:
+        return request({}).text
+    return response_cache.fetch(url, params, kind, request)
+
+
+def fetch_page(data, query_dict, max_retry=1, parse=bgg_parse.parse_soup):
+    """Fetch and parse a page, returning None if every attempt is an error."""
+    for retries in range(max_retry):
         time.sleep(retries)
-        retries += 1
-        query_dict["page"] = page
+        start = time.perf_counter()
         response = get_data(data, query_dict)
-        soup = BeautifulSoup(response, "xml")
+        fetched = time.perf_counter()
+        parsed = parse(response)
+        parsed_time = time.perf_counter()
+        bgg_metrics.record("page", data=data, page=query_dict.get("page"),
+                           seconds=parsed_time - start, parse_seconds=parsed_time - fetched,
+                           bytes=len(response), error=parsed is None)
+
+        if parsed is not None:
+            return parsed
+
+
+def pager(data="thing", query_dict={}, max_retry=1, workers=None, parse=bgg_parse.parse_soup,
+          first_page=1):
+    """
+    Yield parsed pages in order, starting from first_page, until a page fails.
+    Pages are parsed with parse, which returns None for error responses.
+    With more than one worker, the following pages are fetched concurrently
+    while earlier ones are consumed.
+    """
+    if workers is None:
+        workers = pager_workers
+    if workers > 1:
+        yield from concurrent_pager(data, query_dict, max_retry, workers, parse, first_page)
+        return
+
+    page = first_page
+    while True:
+        parsed = fetch_page(data, dict(query_dict, page=page), max_retry, parse)
+        if parsed is None:
+            return
+        page += 1
+        yield page, parsed
+
+
+def concurrent_pager(data, query_dict, max_retry, workers, parse=bgg_parse.parse_soup,
+                     first_page=1):
+    """Yield parsed pages in order, keeping workers requests in flight."""
+    executor = ThreadPoolExecutor(workers)
+    pending = collections.deque()
+    next_page = 1
+
+    def submit(page):
+        pending.append(executor.submit(fetch_page, data, dict(query_dict, page=page),
+                                       max_retry, parse))
 
-        if not soup.find_all("error"):
+    try:
+        for next_page in range(first_page, first_page + workers):
+            submit(next_page)
+        page = first_page
+        while pending:
+            parsed = pending.popleft().result()
+            if parsed is None:
+                return
+            next_page += 1
+            submit(next_page)
             page += 1
-            retries = 0
-            yield page, soup
+            yield page, parsed
+    finally:
+        # Stop fetching speculative pages once the consumer is done.
+        executor.shutdown(wait=False, cancel_futures=True)
 
 
 @retry.retry(ConnectionError, tries=5, delay=1, jitter=1)
-def get_games_by_rank_page(page):
-    """Scrape all games from page of rankings."""
+def get_rank_page(page):
+    """Get list of (id, name) pairs from page of rankings without caching names."""
     url = "https://boardgamegeek.com/browse/boardgame/page/"
     url = "/".join([url, str(page)])
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
+    text = cached_get(url, {}, "browse", lambda headers: session.get(url, headers=headers))
+    soup = BeautifulSoup(text, "html.parser")
 
     # Iterate over all non-header rows
-    with PersistDict("games.json", get_game_name) as games:
-        for row in soup.find_all("tr")[1:]:
-            tag = row.find(attrs={"class": "primary"})
-            name = tag.string
-            game_id = tag.attrs["href"].split("/")[2]
-            games[game_id] = name
-            yield game_id, name
+    games = []
+    for row in soup.find_all("tr")[1:]:
+        tag = row.find(attrs={"class": "primary"})
+        game_id = tag.attrs["href"].split("/")[2]
+        games.append((game_id, str(tag.string)))
+
+    return games
 
 
 @retry.retry(ConnectionError, tries=5, delay=1, jitter=1)
@@ -50,24 +173,63 @@ def get_username(userid, max_retry=5):
     url = "https://boardgamegeek.com/trade/feedback"
     url = "/".join([url, str(userid)])
 
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
+    def request(headers):
+        limiter.acquire()
+        return session.get(url, headers=headers)
+
+    text = cached_get(url, {}, "user", request)
+    soup = BeautifulSoup(text, "html.parser")
     tag = soup.find(attrs={"data-userid": str(userid)})
 
     try:
         return tag.attrs["data-username"]
     except AttributeError:
         print("No username found for %s" % userid)
-
+        # The page may be an error page, so don't keep it.
+        if response_cache is not None:
+            response_cache.discard(url, {})
 
 
 @retry.retry(ConnectionError, tries=5, delay=1, jitter=1)
 def get_data(base_type, params):
-    """Download data from BGG API."""
+    """Download data from BGG API, or get it from the response cache."""
 
     url = "/".join([base_url, base_type])
-    response = requests.get(url, params)
-    return response.text
+    kind = "ratings" if base_type == "thing" and params.get("ratingcomments") else base_type
+    return cached_get(url, params, kind, lambda headers: api_request(url, params, headers))
+
+
+def api_request(url, params, headers=None):
+    """
+    Request data from BGG API, waiting out throttling.
+    Raises ThrottledError if the API still answers 202 or 429 after
+    throttle_retries attempts, and APIError for any other error status, so
+    the answer isn't parsed as an empty page.
+    """
+
+    for attempt in range(throttle_retries):
+        start = time.perf_counter()
+        limiter.acquire()
+        wait = time.perf_counter() - start
+        with bgg_metrics.timer("request", url=url, attempt=attempt, wait=wait) as fields:
+            response = session.get(url, params=params, headers=headers)
+            fields["status"] = response.status_code
+            fields["bytes"] = len(response.content)
+        # BGG answers 202 while a request is queued and 429 when throttling.
+        if response.status_code not in (202, 429):
+            break
+        try:
+            delay = float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            delay = throttle_delay * 2 ** attempt
+        limiter.backoff(delay)
+    else:
+        raise ThrottledError("%s still throttled after %d attempts (HTTP %d)"
+                             % (url, throttle_retries, response.status_code))
+    if response.status_code >= 400:
+        raise APIError("%s answered HTTP %d" % (url, response.status_code))
+
+    return response
 
 
 def find_game(search):
@@ -75,18 +237,7 @@ def find_game(search):
 
     query_dict = {"type": "boardgame", "query": search}
     response = get_data("search", query_dict)
-    soup = BeautifulSoup(response, "xml")
-
-    matches = {}
-
-    with PersistDict("games.json", get_game_name) as games:
-        for tag in soup.find_all("item"):
-            game_id = tag["id"]
-            name = tag.contents[1]["value"]
-            games[game_id] = name
-            matches[game_id] = name
-
-    return matches
+    return bgg_parse.parse_search(response)
 
 
 def select_game():
@@ -108,33 +259,54 @@ def select_game():
     return game_id, name
 
 
-def get_game_info(id_list):
-    """Get game info from ids."""
+# Cached info for each game id, loaded from info_file once per process.
+info_file = "game_info.json"
+info_cache = None
+info_lock = threading.Lock()
 
-    ids = ",".join(id_list)
-    query_dict = {"id": ids, "type": "boardgame"}
-    response = get_data("thing", query_dict)
-    soup = BeautifulSoup(response, "xml")
 
-    games = []
+def get_games_info(ids, chunk_size=20):
+    """
+    Get dict of info for each game id.
+    Info is cached in info_file, and ids not yet cached are fetched with one
+    request per chunk_size ids.
+    """
+    global info_cache
 
-    for id in id_list:
-        tag = soup.find("item", attrs={"id": id})
-        games.append(tag)
+    with info_lock:
+        if info_cache is None:
+            try:
+                with open(info_file) as f:
+                    info_cache = json.load(f)
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                info_cache = {}
+        missing = [id for id in dict.fromkeys(ids) if id not in info_cache]
 
-    return games
+    fetched = {}
+    for i in range(0, len(missing), chunk_size):
+        query_dict = {"id": ",".join(missing[i:i + chunk_size]), "type": "boardgame"}
+        fetched.update(bgg_parse.parse_things(get_data("thing", query_dict)))
+
+    with info_lock:
+        if fetched:
+            info_cache.update(fetched)
+            write_data(info_cache, info_file)
+        return {id: info_cache[id] for id in ids if id in info_cache}
+
+
+def get_game_names(ids):
+    """Get dict of game names from IDs."""
+    return {id: info["name"] for id, info in get_games_info(ids).items()}
 
 
 def get_game_name(game_id):
     """Get game name from ID."""
-    game_info = get_game_info([game_id])[0]
-    return game_info.find("name", attrs={"type": "primary"})["value"]
+    return get_games_info([game_id])[game_id]["name"]
 
 
 def get_game_year(game_id):
     """Get year published from ID."""
-    game_info = get_game_info([game_id])[0]
-    return game_info.find("yearpublished")["value"]
+    return get_games_info([game_id])[game_id]["year"]
 
 
 def write_data(data_dict, filename):
@@ -145,49 +317,329 @@ def write_data(data_dict, filename):
         json.dump(data_dict, jsonfile)
 
 
-def read_data(id, dir, func, update=False):
-    """Read data into dict."""
+def sync_file(id, dir):
+    """Get the file holding sync metadata for id."""
+    return "%s/sync/%s.json" % (dir, id)
 
-    filename = "%s/%s.json" % (dir, id)
 
-    if os.path.exists(filename):
+def read_sync(id, dir):
+    """Get sync metadata for id from the last download, without writing anything."""
+    try:
+        with open(sync_file(id, dir)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def write_sync(id, dir, sync_dict):
+    """
+    Save sync metadata for id.
+    Each id has its own file, replaced atomically, so threads and worker
+    processes saving different ids never overwrite each other.
+    """
+    sync_dict["time"] = time.time()
+    filename = sync_file(id, dir)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temp_filename = "%s.%d.%d.tmp" % (filename, os.getpid(), threading.get_ident())
+    with open(temp_filename, "w") as f:
+        json.dump(sync_dict, f)
+    os.replace(temp_filename, filename)
+
+
+def data_file(id, dir):
+    """Get the record log file for id."""
+    return "%s/%s.jsonl" % (dir, id)
+
+
+def data_path(id, dir):
+    """Get the file holding data for id, which may be a JSON file from older versions."""
+    filename = data_file(id, dir)
+    legacy = "%s/%s.json" % (dir, id)
+    if not os.path.exists(filename) and os.path.exists(legacy):
+        return legacy
+    return filename
+
+
+def iter_data(id, dir, func=None):
+    """
+    Yield (key, record) pairs of downloaded data without reading it all into
+    memory. If func is given, data that has not been downloaded is read first.
+    """
+    if func is not None and not os.path.exists(data_path(id, dir)):
+        read_data(id, dir, func)
+
+    filename = data_path(id, dir)
+    if filename.endswith(".json"):
         with open(filename) as jsonfile:
-            records = json.load(jsonfile)
-            if update:
-                records = update_data(id, records, func)
-                write_data(records, filename)
-            return records
+            yield from json.load(jsonfile).items()
     else:
-        os.makedirs(dir, exist_ok=True)
+        yield from RecordLog(filename)
+
+
+def read_data(id, dir, func, update=False, store=None):
+    """
+    Read data into dict.
+    Pages of records are appended to a record log as they are downloaded, so an
+    interrupted download resumes after its last complete page.
+    With update, records are fetched again, using the sync metadata func keeps
+    for each id to limit what it fetches where its ordering allows.
+    If a store is given, records are also added to it when they are first
+    downloaded, changed, or missing from the store.
+    """
+
+    os.makedirs(dir, exist_ok=True)
+    log = RecordLog(data_file(id, dir))
+    legacy = "%s/%s.json" % (dir, id)
+    if not log.complete() and os.path.exists(legacy):
+        with open(legacy) as jsonfile:
+            log.write(json.load(jsonfile))
+        os.remove(legacy)
+
+    sync = read_sync(id, dir)
+    changed = False
+
+    if log.complete():
+        records = dict(log)
+        if update:
+            old_records = dict(records)
+            log.discard_pending()
+            records = update_data(id, records, func, sync, log)
+            changed = records != old_records
+            if changed:
+                log.write(records)
+            else:
+                log.discard_pending()
+            write_sync(id, dir, sync)
+    else:
+        # Resume from the pages of an interrupted download.
+        records = {}
+        sync = {}
+        pages = log.pending()
+        for page, page_records in pages:
+            records.update(page_records)
+        if pages:
+            sync["next_page"] = pages[-1][0] + 1
         for _ in range(5):
-            records = {}
-            for k, v in func(id):
-                records[k] = v
+            log_records(id, func, sync, records, log)
             if records:
                 break
-        write_data(records, filename)
-        return records
+        sync.pop("next_page", None)
+        log.write(records)
+        write_sync(id, dir, sync)
+        changed = True
 
+    if store is not None and (changed or id not in store):
+        with bgg_metrics.timer("persist", op="store", stored=len(records)):
+            store.add(id, records)
 
-def update_data(id, records, func):
-    """Read updated data into dict."""
-    page = len
-    for _ in range(5):
-        for k, v in func(id):
-            if k in records:
-                if v == records[k]:
-                    break
-            records[k] = v
-        if records:
-            break
     return records
 
 
-class PersistDict(object):
-    """Dict with JSON serialization and lookup func for missing keys."""
-    def __init__(self, file_path, func):
+def update_data(id, records, func, sync=None, log=None):
+    """
+    Read updated data into a new dict.
+    func is given the total number of records stored in sync["last_total"],
+    and reports the current total in sync["total"]. If the fetched records
+    match that total, they replace the old ones, so changed and removed records
+    are picked up. Otherwise they are merged into the old records, and the
+    total is only kept if the merged records match it, so that it always
+    describes records that were stored.
+    """
+    if sync is None:
+        sync = {}
+    sync["last_total"] = sync.pop("total", None)
+    fetched = {}
+    log_records(id, func, sync, fetched, log)
+    sync.pop("last_total")
+
+    if sync.get("total") == len(fetched):
+        return fetched
+    merged = dict(records)
+    merged.update(fetched)
+    if sync.get("total") != len(merged):
+        sync.pop("total", None)
+    return merged
+
+
+def log_records(id, func, sync, records, log=None):
+    """
+    Add records from func to dict, appending each finished page to log.
+    func sets sync["page"] to the page it is yielding records from.
+    """
+    if sync is None:
+        sync = {}
+    page = None
+    page_records = {}
+
+    for k, v in func(id, sync):
+        if sync.get("page") != page:
+            if page_records and log is not None:
+                log.append(page, page_records)
+            page = sync.get("page")
+            page_records = {}
+        records[k] = v
+        page_records[k] = v
+
+    if page_records and log is not None:
+        log.append(page, page_records)
+
+
+class RecordLog(object):
+    """
+    Append-only, line-delimited JSON log of downloaded records.
+
+    Each line holds one page of records, and a done line marks the end of a
+    complete download. Pages are appended as they arrive; when a download
+    finishes, the log is rewritten with the final records and a done line.
+    Iterating yields the records of the last complete download.
+    """
+
+    done_line = b'{"done": true}\n'
+
+    def __init__(self, filename, page_size=1000):
+        self.filename = filename
+        self.page_size = page_size
+
+    def done_offset(self, block_size=1 << 16):
+        """
+        Get the file offset just past the last done line, or None.
+        The file is searched backwards from its end, so only pages appended
+        since the last done line are read.
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                position = f.seek(0, os.SEEK_END)
+                tail = b""
+                while position > 0:
+                    start = max(0, position - block_size)
+                    f.seek(start)
+                    # Keep enough of the later block to find a line split between the two.
+                    tail = f.read(position - start) + tail[:len(self.done_line)]
+                    index = tail.rfind(b"\n" + self.done_line)
+                    if index >= 0:
+                        return start + index + 1 + len(self.done_line)
+                    if start == 0 and tail.startswith(self.done_line):
+                        return len(self.done_line)
+                    position = start
+        except FileNotFoundError:
+            pass
+
+    def complete(self):
+        return self.done_offset() is not None
+
+    def __iter__(self):
+        end = self.done_offset()
+        if end is None:
+            return
+        position = 0
+        with open(self.filename, "rb") as f:
+            for line in f:
+                position += len(line)
+                if position > end:
+                    break
+                if line != self.done_line:
+                    yield from json.loads(line)["records"].items()
+
+    def pending(self):
+        """
+        Get (page, records) pairs appended since the last done line.
+        A partly written last line is dropped from the file.
+        """
+        start = self.done_offset() or 0
+        pages = []
+        try:
+            with open(self.filename, "rb+") as f:
+                f.seek(start)
+                position = start
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    position += len(line)
+                    pages.append((entry["page"], entry["records"]))
+                f.truncate(position)
+        except FileNotFoundError:
+            pass
+        return pages
+
+    def discard_pending(self):
+        """Drop pages appended since the last done line."""
+        offset = self.done_offset()
+        if offset is not None:
+            with open(self.filename, "rb+") as f:
+                f.truncate(offset)
+
+    def append(self, page, records):
+        """Append a page of records."""
+        with bgg_metrics.timer("persist", op="append", records=len(records)):
+            with open(self.filename, "a") as f:
+                f.write(json.dumps({"page": page, "records": records}) + "\n")
+
+    def write(self, records):
+        """Replace the log with a complete download of records."""
+        with bgg_metrics.timer("persist", op="write", rewritten=len(records)):
+            self._write(records)
+
+    def _write(self, records):
+        items = list(records.items())
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as f:
+            for i in range(0, len(items), self.page_size):
+                page_records = dict(items[i:i + self.page_size])
+                f.write(json.dumps({"page": i // self.page_size + 1,
+                                    "records": page_records}) + "\n")
+            f.write(self.done_line.decode())
+        os.replace(temp_filename, self.filename)
+
+
+def downloaded_ids(dir):
+    """Get sorted ids of all games with data downloaded in dir."""
+    files = glob.glob("%s/*.jsonl" % dir) + glob.glob("%s/*.json" % dir)
+    ids = {os.path.basename(os.path.splitext(f)[0]) for f in files}
+    return sorted(ids, key=lambda id: (len(id), id))
+
+
+def map_games(func, ids, workers=None):
+    """
+    Map func over game ids on a pool of worker processes.
+    Returns results in the order of ids. With one worker, runs in this process.
+    """
+    ids = list(ids)
+    if workers is None:
+        workers = os.cpu_count()
+    if workers == 1 or len(ids) < 2:
+        return [func(id) for id in ids]
+
+    chunksize = max(1, len(ids) // (4 * workers))
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(func, ids, chunksize=chunksize))
+
+
+def refresh_data(dir, func, max_age=0, workers=1, store=None):
+    """Update all downloaded data in dir not synced in the last max_age seconds."""
+    now = time.time()
+    stale = [id for id in downloaded_ids(dir) if now - read_sync(id, dir).get("time", 0) >= max_age]
+
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(lambda id: read_data(id, dir, func, True, store), stale))
+
+    return stale
+
+
+class SummaryCache(object):
+    """
+    JSON cache of per-game summaries, each stored with a fingerprint of the
+    game's data file so that it is recomputed only when the file changes.
+    Counts cache hits and misses.
+    """
+    def __init__(self, file_path, dir):
         self.file_path = file_path
-        self.func = func
+        self.dir = dir
+        self.hits = 0
+        self.misses = 0
 
     def __enter__(self):
         try:
@@ -201,10 +653,36 @@ class PersistDict(object):
         with open(self.file_path, "w") as f:
             json.dump(self.dict, f)
 
-    def __getitem__(self, k):
-        if k not in self.dict:
-            self.dict[k] = self.func(k)
-        return self.dict[k]
-
-    def __setitem__(self, k, v):
-        self.dict[k] = v
+    def fingerprint(self, id):
+        """Get modification time and size of the data file for id."""
+        stat = os.stat(data_path(id, self.dir))
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def stale(self, ids):
+        """Get ids with no summary or one computed from an older data file."""
+        self.fingerprints = {id: self.fingerprint(id) for id in ids}
+        stale = [id for id in ids
+                 if self.dict.get(id, {}).get("fingerprint") != self.fingerprints[id]]
+        self.hits += len(ids) - len(stale)
+        self.misses += len(stale)
+        return stale
+
+    def update(self, summaries):
+        """Store summaries for ids returned by stale."""
+        for id, summary in summaries.items():
+            self.dict[id] = {"fingerprint": self.fingerprints[id], "summary": summary}
+
+    def __getitem__(self, id):
+        return self.dict[id]["summary"]
+
+    def map(self, func, ids, workers=None):
+        """
+        Get summaries for ids, calling func on a pool of worker processes for
+        stale ids.
+        """
+        stale = self.stale(ids)
+        self.update(dict(zip(stale, map_games(func, stale, workers))))
+        return {id: self[id] for id in ids}
+
+    def report(self):
+        print("%s: %d hits, %d misses" % (self.file_path, self.hits, self.misses))
@@ -0,0 +1,118 @@
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import bgg_compare
+import bgg_core
+import bgg_metrics
+import bgg_store
+
+GAMES_PER_RANK_PAGE = 100
+
+
+class Progress(object):
+    """Count scheduled and finished tasks for each stage of a crawl."""
+    def __init__(self, stages):
+        self.total = dict.fromkeys(stages, 0)
+        self.done = dict.fromkeys(stages, 0)
+
+    def add(self, stage, n=1):
+        self.total[stage] += n
+
+    def finish(self, stage, n=1):
+        self.done[stage] += n
+        self.report()
+
+    def report(self):
+        print(", ".join("%s %d/%d" % (stage, self.done[stage], self.total[stage])
+                        for stage in self.total))
+
+
+def crawl(pages, limit=None, workers=4, batch_size=20, state_file="crawl.json",
+          max_age=86400):
+    """
+    Download ratings for all games on the given pages of rankings.
+    Rank pages, game metadata and ratings are fetched as one pipeline over a
+    shared pool of workers, all paced by the API rate limiter. Rank pages are
+    saved to state_file and ratings to the ratings directory as they finish, so
+    an interrupted crawl resumes where it left off. Saved rank pages older than
+    max_age seconds are fetched again.
+    Returns a list of (game id, name) pairs in rank order, stopping after limit
+    games.
+    """
+
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        state = {}
+    ranked = state.setdefault("pages", {})
+
+    pages = list(pages)
+    if limit is None:
+        limit = len(pages) * GAMES_PER_RANK_PAGE
+    # Number of games to keep from each page.
+    page_limits = {page: min(GAMES_PER_RANK_PAGE, limit - i * GAMES_PER_RANK_PAGE)
+                   for i, page in enumerate(pages)
+                   if limit > i * GAMES_PER_RANK_PAGE}
+
+    store = bgg_store.RatingStore()
+    progress = Progress(["rank pages", "metadata", "ratings"])
+    futures = {}
+    executor = ThreadPoolExecutor(workers)
+
+    def schedule(games):
+        """Queue metadata and ratings downloads for games from a rank page."""
+        ids = [game_id for game_id, _ in games]
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            future = executor.submit(bgg_core.get_games_info, batch, batch_size)
+            futures[future] = ("metadata", batch)
+            progress.add("metadata")
+
+        for game_id, _ in games:
+            progress.add("ratings")
+            if game_id in store:
+                progress.finish("ratings")
+            else:
+                future = executor.submit(bgg_core.read_data, game_id, "ratings",
+                                         bgg_compare.get_ratings)
+                futures[future] = ("ratings", game_id)
+
+    for page in page_limits:
+        progress.add("rank pages")
+        saved = ranked.get(str(page))
+        if saved and time.time() - saved["time"] < max_age:
+            progress.finish("rank pages")
+            schedule(saved["games"][:page_limits[page]])
+        else:
+            futures[executor.submit(bgg_core.get_rank_page, page)] = ("rank pages", page)
+
+    try:
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, key = futures.pop(future)
+                result = future.result()
+
+                if stage == "rank pages":
+                    ranked[str(key)] = {"time": time.time(), "games": result}
+                    with open(state_file, "w") as f:
+                        json.dump(state, f)
+                    schedule(result[:page_limits[key]])
+                elif stage == "metadata":
+                    pass
+                else:
+                    with bgg_metrics.timer("persist", op="store", stored=len(result)):
+                        store.add(key, result)
+
+                progress.finish(stage)
+    finally:
+        # Drop queued downloads on interruption; finished ones are kept.
+        executor.shutdown(wait=False, cancel_futures=True)
+        bgg_metrics.report()
+
+    games = []
+    for page, page_limit in page_limits.items():
+        games += [tuple(game) for game in ranked[str(page)]["games"][:page_limit]]
+    return games
@@ -0,0 +1,111 @@
+import collections
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# File to append metric events to as JSON lines, or None to only keep them in memory.
+log_file = None
+
+lock = threading.Lock()
+start_time = time.time()
+events = collections.defaultdict(list)
+
+
+def reset():
+    """Forget recorded events and restart the run clock."""
+    global start_time
+    with lock:
+        start_time = time.time()
+        events.clear()
+
+
+def record(event, **fields):
+    """Record an event, such as a request or parsed page, with its measurements."""
+    fields["time"] = time.time()
+    with lock:
+        events[event].append(fields)
+        if log_file is not None:
+            with open(log_file, "a") as f:
+                f.write(json.dumps(dict(event=event, **fields)) + "\n")
+
+
+@contextmanager
+def timer(event, **fields):
+    """
+    Record an event with the seconds spent in the with block.
+    Yields the dict of fields so that measurements can be added inside it.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(event, seconds=time.perf_counter() - start, **fields)
+
+
+def percentiles(values):
+    """Get the 50th and 95th percentiles of values, or NaN if there are none."""
+    if not values:
+        return float("nan"), float("nan")
+    return tuple(float(p) for p in np.percentile(values, [50, 95]))
+
+
+def summary():
+    """Summarize recorded events into a dict of stats for each kind of event."""
+    with lock:
+        elapsed = time.time() - start_time
+        recorded = {event: list(fields) for event, fields in events.items()}
+
+    stats = {"elapsed": elapsed}
+    for event, fields in recorded.items():
+        seconds = [f["seconds"] for f in fields if "seconds" in f]
+        p50, p95 = percentiles(seconds)
+        stats[event] = {
+            "count": len(fields),
+            "p50": p50,
+            "p95": p95,
+            "seconds": sum(seconds),
+            "bytes": sum(f.get("bytes", 0) for f in fields),
+            "records": sum(f.get("records", 0) for f in fields),
+            "per_sec": len(fields) / elapsed if elapsed else float("nan"),
+        }
+
+    requests = recorded.get("request", [])
+    if requests:
+        stats["request"]["throttled"] = sum(f.get("status") in (202, 429) for f in requests)
+        stats["request"]["retried"] = sum(f.get("attempt", 0) > 0 for f in requests)
+        stats["request"]["wait"] = sum(f.get("wait", 0) for f in requests)
+    pages = recorded.get("page", [])
+    if pages:
+        stats["page"]["parse_p50"], stats["page"]["parse_p95"] = percentiles(
+            [f["parse_seconds"] for f in pages if "parse_seconds" in f])
+        stats["page"]["errors"] = sum(bool(f.get("error")) for f in pages)
+    if "persist" in stats:
+        stats["persist"]["records_per_sec"] = \
+            stats["persist"]["records"] / elapsed if elapsed else float("nan")
+
+    return stats
+
+
+def report():
+    """Print a summary of recorded events."""
+    stats = summary()
+    print("Metrics over %.1fs:" % stats["elapsed"])
+    if "request" in stats:
+        s = stats["request"]
+        print("Requests: %d, p50 %.3fs, p95 %.3fs, %.1f MB, %d throttled, %d retried, "
+              "%.1fs waiting for rate limit"
+              % (s["count"], s["p50"], s["p95"], s["bytes"] / 2 ** 20, s["throttled"],
+                 s["retried"], s["wait"]))
+    if "page" in stats:
+        s = stats["page"]
+        print("Pages: %d, p50 %.3fs, p95 %.3fs, parse p50 %.4fs, p95 %.4fs, %d errors, "
+              "%.2f pages/sec"
+              % (s["count"], s["p50"], s["p95"], s["parse_p50"], s["parse_p95"], s["errors"],
+                 s["per_sec"]))
+    if "persist" in stats:
+        s = stats["persist"]
+        print("Persisted: %d writes, p50 %.4fs, p95 %.4fs, %d records, %.1f records/sec"
+              % (s["count"], s["p50"], s["p95"], s["records"], s["records_per_sec"]))
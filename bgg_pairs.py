@@ -0,0 +1,287 @@
+import json
+import os
+
+import numpy as np
+
+import bgg_store
+
+# Head-to-head stats kept for every pair of games, with their on-disk dtypes.
+PAIR_ARRAYS = {"common": np.int32, "wins": np.int32, "ties": np.int32,
+               "mean_diff": np.float32}
+
+
+def block_stats(a_users, a_games, a_ratings, b_users, b_games, b_ratings, shape,
+                max_pairs=2 ** 24):
+    """
+    Count head-to-head stats between two blocks of games.
+    Takes the user ids, block positions of games and ratings of the ratings in
+    each block, where block b is sorted by user. Pairs of ratings by the same
+    user are generated at most max_pairs at a time.
+    Returns block matrices of common raters, wins, losses and the sum of rating
+    differences, where entry [i, j] compares game i of block a against game j
+    of block b.
+    """
+
+    size = shape[0] * shape[1]
+    common = np.zeros((size,), dtype=np.int64)
+    wins = np.zeros((size,), dtype=np.int64)
+    losses = np.zeros((size,), dtype=np.int64)
+    sum_diff = np.zeros((size,), dtype=np.float64)
+
+    # Each rating in block a pairs with the run of the same user's ratings in block b.
+    starts = np.searchsorted(b_users, a_users, "left")
+    counts = np.searchsorted(b_users, a_users, "right") - starts
+    ends = np.cumsum(counts)
+
+    start = 0
+    while start < len(a_users):
+        done = ends[start - 1] if start else 0
+        stop = max(int(np.searchsorted(ends, done + max_pairs, "right")), start + 1)
+        batch_counts = counts[start:stop]
+        num_pairs = int(batch_counts.sum())
+
+        left = np.repeat(np.arange(start, stop), batch_counts)
+        offsets = np.arange(num_pairs) - np.repeat(np.cumsum(batch_counts) - batch_counts,
+                                                   batch_counts)
+        right = np.repeat(starts[start:stop], batch_counts) + offsets
+
+        key = a_games[left].astype(np.int64) * shape[1] + b_games[right]
+        diff = a_ratings[left].astype(np.float64) - b_ratings[right]
+        common += np.bincount(key, minlength=size)
+        sum_diff += np.bincount(key, weights=diff, minlength=size)
+        wins += np.bincount(key[diff > 0], minlength=size)
+        losses += np.bincount(key[diff < 0], minlength=size)
+        start = stop
+
+    return (common.reshape(shape), wins.reshape(shape), losses.reshape(shape),
+            sum_diff.reshape(shape))
+
+
+def compute_pairs(store=None, ids=None, path="pairs", block_size=1024, max_pairs=2 ** 24):
+    """
+    Compute head-to-head stats for every pair of games from scratch.
+    Takes a rating store and a list of game ids, defaulting to every stored
+    game, and saves them as a PairMatrix at path. Matrices are filled block by
+    block of block_size games, so only the ratings and one block pair are held
+    in memory.
+    """
+
+    if store is None:
+        store = bgg_store.RatingStore()
+    if ids is None:
+        ids = list(store.games)
+    ids = [str(game_id) for game_id in ids]
+    num_games = len(ids)
+
+    pairs = PairMatrix(path)
+    pairs.clear()
+    pairs._reserve(num_games)
+    pairs.ids = ids
+    pairs.index = {game_id: i for i, game_id in enumerate(ids)}
+
+    users, games, ratings = store.by_user(ids)
+    blocks = [(b0, min(b0 + block_size, num_games)) for b0 in range(0, num_games, block_size)]
+    block_ratings = []
+    for b0, b1 in blocks:
+        elems = np.flatnonzero((games >= b0) & (games < b1))
+        block_ratings.append((users[elems], games[elems] - b0, ratings[elems]))
+
+    for a, (a0, a1) in enumerate(blocks):
+        for b in range(a, len(blocks)):
+            b0, b1 = blocks[b]
+            stats = block_stats(*block_ratings[a], *block_ratings[b], (a1 - a0, b1 - b0),
+                                max_pairs)
+            pairs._write_block(slice(a0, a1), slice(b0, b1), *stats)
+
+        print("Computed pairs for games %d-%d of %d" % (a0 + 1, a1, num_games))
+
+    pairs._finish({game_id: store.checksum(game_id) for game_id in ids})
+    return pairs
+
+
+class PairMatrix(object):
+    """
+    Head-to-head stats for every pair of games, memory-mapped from disk.
+
+    Each stat is a square .npy matrix with a row and column per game, in the
+    order of ids. Adding games only computes their new rows and columns, and a
+    game whose ratings changed in the store since it was added only has its own
+    row and column recomputed. The files are allocated with spare capacity so
+    that games can be added without rewriting them every time.
+    """
+
+    def __init__(self, path="pairs"):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        try:
+            with open(self._file("index.json")) as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            index = {"ids": [], "checksums": {}}
+        self.ids = index["ids"]
+        # Rating store checksum of each game when its stats were computed.
+        self.checksums = index["checksums"]
+        self.index = {game_id: i for i, game_id in enumerate(self.ids)}
+
+        self._arrays = {}
+        if self.ids:
+            for name in PAIR_ARRAYS:
+                self._arrays[name] = np.load(self._file(name + ".npy"), mmap_mode="r+")
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _array(self, name):
+        """Get the used part of one of the stat matrices."""
+        if name not in self._arrays:
+            return np.zeros((0, 0), dtype=PAIR_ARRAYS[name])
+        num_games = len(self.ids)
+        return self._arrays[name][:num_games, :num_games]
+
+    @property
+    def common(self):
+        """Number of users who rated both games."""
+        return self._array("common")
+
+    @property
+    def wins(self):
+        """Number of users who rated the row game higher than the column game."""
+        return self._array("wins")
+
+    @property
+    def ties(self):
+        """Number of users who rated both games the same."""
+        return self._array("ties")
+
+    @property
+    def mean_diff(self):
+        """Mean rating of the row game minus the column game among common users."""
+        return self._array("mean_diff")
+
+    def __contains__(self, game_id):
+        return str(game_id) in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def head_to_head(self, a, b):
+        """Get stats comparing game a against game b."""
+        i = self.index[str(a)]
+        j = self.index[str(b)]
+        return {
+            "common": int(self.common[i, j]),
+            "wins": int(self.wins[i, j]),
+            "losses": int(self.wins[j, i]),
+            "ties": int(self.ties[i, j]),
+            "mean_diff": float(self.mean_diff[i, j]),
+        }
+
+    def submatrix(self, name, ids):
+        """Get the matrix of one stat for the given games, in the order of ids."""
+        rows = np.array([self.index[str(game_id)] for game_id in ids], dtype=np.intp)
+        return np.asarray(self._array(name)[np.ix_(rows, rows)])
+
+    def update(self, store, ids, block_size=256, max_pairs=2 ** 24):
+        """
+        Bring stats for the given games up to date with the rating store.
+        Games not yet in the matrix get new rows and columns, and games whose
+        ratings changed have theirs recomputed. Other entries are left as is.
+        """
+
+        ids = list(dict.fromkeys(str(game_id) for game_id in ids))
+        checksums = {game_id: store.checksum(game_id) for game_id in ids}
+        changed = [self.index[game_id] for game_id in ids
+                   if game_id in self.index and self.checksums[game_id] != checksums[game_id]]
+        new = [game_id for game_id in ids if game_id not in self.index]
+        if not changed and not new:
+            return self
+
+        start = len(self.ids)
+        self._reserve(start + len(new))
+        self.ids.extend(new)
+        self.index.update((game_id, start + i) for i, game_id in enumerate(new))
+
+        # Changed games are compared against every game, new games only against
+        # those before them, as later ones are compared against them in turn.
+        for i in range(0, len(changed), block_size):
+            self._fill(store, np.array(changed[i:i + block_size]), len(self.ids), max_pairs)
+        for b0 in range(start, len(self.ids), block_size):
+            b1 = min(b0 + block_size, len(self.ids))
+            self._fill(store, np.arange(b0, b1), b1, max_pairs)
+
+        print("Updated pairs for %d new and %d changed games" % (len(new), len(changed)))
+        self._finish({game_id: checksums[game_id]
+                      for game_id in new + [self.ids[i] for i in changed]})
+        return self
+
+    def clear(self):
+        """Remove all games."""
+        self.ids = []
+        self.checksums = {}
+        self.index = {}
+        self._arrays = {}
+        self._write_index()
+
+    def _reserve(self, num_games):
+        """Make sure the stat matrices have room for num_games games."""
+        capacity = len(self._arrays["common"]) if self._arrays else 0
+        if self._arrays and num_games <= capacity:
+            return
+        capacity = max(num_games, 2 * capacity, 16)
+        used = len(self.ids)
+
+        for name, dtype in PAIR_ARRAYS.items():
+            tmp_file = self._file(name + ".npy.tmp")
+            array = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=dtype,
+                                              shape=(capacity, capacity))
+            if name in self._arrays:
+                array[:used, :used] = self._arrays[name][:used, :used]
+            array.flush()
+            del array
+            os.replace(tmp_file, self._file(name + ".npy"))
+            self._arrays[name] = np.load(self._file(name + ".npy"), mmap_mode="r+")
+
+    def _fill(self, store, positions, limit, max_pairs):
+        """Compute stats of the games at positions against the first limit games."""
+        local = np.full((limit,), -1, dtype=np.int64)
+        local[positions] = np.arange(len(positions))
+
+        rows = [store.ratings(self.ids[i])[0] for i in positions]
+        users = np.unique(np.concatenate(rows))
+        b_users, b_games, b_ratings = store.by_user(self.ids[:limit], users)
+        a = local[b_games] >= 0
+
+        stats = block_stats(b_users[a], local[b_games[a]], b_ratings[a],
+                            b_users, b_games, b_ratings, (len(positions), limit), max_pairs)
+        self._write_block(positions, slice(0, limit), *stats)
+
+    def _write_block(self, rows, cols, common, wins, losses, sum_diff):
+        """Write stats for a block of games, and their transpose."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_diff = sum_diff / common
+        ties = common - wins - losses
+
+        for name, block, block_t in [("common", common, common.T), ("wins", wins, losses.T),
+                                     ("ties", ties, ties.T),
+                                     ("mean_diff", mean_diff, -mean_diff.T)]:
+            self._arrays[name][rows, cols] = block
+            self._arrays[name][cols, rows] = block_t
+
+    def _finish(self, checksums):
+        """Record the rating checksums of updated games and save the index."""
+        for game_id, checksum in checksums.items():
+            # A game's own ratings are not a tie against itself.
+            i = self.index[game_id]
+            self._arrays["ties"][i, i] = 0
+            self.checksums[game_id] = checksum
+
+        for array in self._arrays.values():
+            array.flush()
+        self._write_index()
+
+    def _write_index(self):
+        tmp_file = self._file("index.json.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump({"ids": self.ids, "checksums": self.checksums}, f)
+        os.replace(tmp_file, self._file("index.json"))
@@ -0,0 +1,180 @@
+import xml.etree.ElementTree as ET
+
+from bs4 import BeautifulSoup
+
+# Parser for API responses: "etree" streams over parse events with the standard
+# library, "soup" builds a full BeautifulSoup tree.
+backend = "etree"
+# Characters of a response fed to the etree parser at a time.
+chunk_size = 1 << 16
+
+
+def iterparse(text, events=("start",)):
+    """
+    Yield (event, element) pairs from an XML string.
+    The text is fed to the parser in chunks and the events of each chunk are
+    yielded before the next is parsed, so elements the caller clears once
+    handled are not all held at once. Raises ET.ParseError if the text is not
+    well-formed XML, such as an empty body or an HTML error page.
+    """
+    parser = ET.XMLPullParser(events)
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def parse_soup(text):
+    """Parse a response into a BeautifulSoup tree, or None if it is an error."""
+    soup = BeautifulSoup(text, "xml")
+    if not soup.find_all("error"):
+        return soup
+
+
+def parse_ratings(text):
+    """
+    Parse a page of rating comments.
+    Returns the total number of ratings and a list of (username, rating) pairs,
+    or None if the response is an error.
+    """
+    if backend == "soup":
+        soup = parse_soup(text)
+        if soup is None:
+            return None
+        comments = soup.find("comments")
+        total = int(comments["totalitems"]) if comments is not None else None
+        return total, [(tag["username"], tag["rating"]) for tag in soup.find_all("comment")]
+
+    total = None
+    ratings = []
+    try:
+        for event, elem in iterparse(text, ("start", "end")):
+            if event == "end":
+                if elem.tag == "comment":
+                    elem.clear()
+            elif elem.tag == "comment":
+                ratings.append((elem.get("username"), elem.get("rating")))
+            elif elem.tag == "comments":
+                total = int(elem.get("totalitems"))
+            elif elem.tag == "error":
+                return None
+    except ET.ParseError:
+        return None
+    return total, ratings
+
+
+def play_dict(attrs, players):
+    """Build the record kept for a play."""
+    return {
+        "userid": attrs["userid"],
+        "date": attrs["date"],
+        "length": int(attrs["length"]),
+        "quantity": int(attrs["quantity"]),
+        "players": players,
+    }
+
+
+def parse_plays(text):
+    """
+    Parse a page of plays.
+    Returns the total number of plays and a list of (id, play dict) pairs, or
+    None if the response is an error.
+    """
+    if backend == "soup":
+        soup = parse_soup(text)
+        if soup is None:
+            return None
+        plays_tag = soup.find("plays")
+        total = None
+        if plays_tag is not None and "total" in plays_tag.attrs:
+            total = int(plays_tag["total"])
+        return total, [(tag["id"], play_dict(tag.attrs, len(tag.find_all("player"))))
+                       for tag in soup.find_all("play")]
+
+    total = None
+    plays = []
+    play = None
+    try:
+        for event, elem in iterparse(text, ("start", "end")):
+            if event == "start":
+                if elem.tag == "player":
+                    players += 1
+                elif elem.tag == "play":
+                    play = elem
+                    players = 0
+                elif elem.tag == "plays" and "total" in elem.attrib:
+                    total = int(elem.get("total"))
+                elif elem.tag == "error":
+                    return None
+            elif elem.tag == "play":
+                plays.append((play.get("id"), play_dict(play.attrib, players)))
+                # Free the finished play's subtree.
+                elem.clear()
+    except ET.ParseError:
+        return None
+    return total, plays
+
+
+def parse_search(text):
+    """Parse search results into a dict of id-name pairs, empty if the response isn't XML."""
+    if backend == "soup":
+        soup = BeautifulSoup(text, "xml")
+        return {tag["id"]: tag.contents[1]["value"] for tag in soup.find_all("item")}
+
+    matches = {}
+    game_id = None
+    try:
+        for _, elem in iterparse(text):
+            if elem.tag == "item":
+                game_id = elem.get("id")
+            elif elem.tag == "name" and game_id is not None:
+                matches[game_id] = elem.get("value")
+                game_id = None
+    except ET.ParseError:
+        return {}
+    return matches
+
+
+# Fields kept from thing items, and the tags they are read from.
+THING_FIELDS = [("year", "yearpublished"), ("minplayers", "minplayers"),
+                ("maxplayers", "maxplayers"), ("playingtime", "playingtime")]
+
+
+def parse_things(text):
+    """Parse thing items into a dict of id-info pairs, empty if the response isn't XML."""
+    if backend == "soup":
+        soup = BeautifulSoup(text, "xml")
+        return {tag["id"]: parse_thing_tag(tag) for tag in soup.find_all("item")}
+
+    fields = dict((name, field) for field, name in THING_FIELDS)
+    things = {}
+    info = None
+    depth = 0
+    try:
+        for event, elem in iterparse(text, ("start", "end")):
+            if event == "end":
+                depth -= 1
+                continue
+            depth += 1
+            if elem.tag == "item" and depth == 2:
+                info = things[elem.get("id")] = {}
+            elif info is None or depth != 3:
+                continue
+            elif elem.tag == "name" and elem.get("type") == "primary":
+                info["name"] = elem.get("value")
+            elif elem.tag in fields:
+                info[fields[elem.tag]] = elem.get("value")
+    except ET.ParseError:
+        return {}
+    return things
+
+
+def parse_thing_tag(tag):
+    """Get dict of info from a BeautifulSoup thing item tag."""
+    info = {"name": tag.find("name", attrs={"type": "primary"})["value"]}
+    for field, name in THING_FIELDS:
+        field_tag = tag.find(name)
+        if field_tag is not None:
+            info[field] = field_tag["value"]
+    return info
@@ -1,19 +1,27 @@
 import collections
+import functools
 import glob
 import json
 import os
 
+import numpy as np
+
 import bgg_core
 import bgg_compare
+import bgg_store
 import bgg_time
+import bgg_users
+
+# Lower edges of the bins ratings are averaged over, for plays logged per
+# user, minutes played per user and the average player count of a user's plays.
+play_bins = [0, 1, 2, 3, 5, 10, 20, 50]
+time_bins = [0, 1, 60, 180, 600, 1800, 6000]
+player_bins = [1, 2, 3, 4, 5, 6, 7, 8]
 
 
 def collect_game_stats(game_id):
     """Collect all game stats."""
-    ratings = bgg_core.read_data(game_id, "ratings", bgg_compare.get_ratings)
-    sum_rating = sum(float(r) for r in ratings.values())
-    avg_rating = sum_rating / len(ratings)
-
+    avg_rating = bgg_compare.average_rating(game_id)
 
     play_stats = bgg_time.play_stats(game_id)
 
@@ -22,19 +30,18 @@ def collect_game_stats(game_id):
     return play_stats
 
 
-def all_games_stats():
-    """Get all downloaded game stats."""
-    all_ratings = bgg_compare.all_ratings()
-    all_play_stats = bgg_time.all_play_stats()
+def all_games_stats(workers=None):
+    """Get all downloaded game stats, in order of game id."""
+    all_ratings = bgg_compare.all_ratings(workers)
+    all_play_stats = bgg_time.all_play_stats(workers)
 
     all_stats = {}
-    with bgg_core.PersistDict("games.json", bgg_core.get_game_name) as games:
-        for g in games.dict:
-            name = games[g]
-            try:
-                all_stats[name] = {**all_ratings[g], **all_play_stats[g]}
-            except KeyError:
-                pass
+    names = bgg_core.get_game_names(list(all_ratings))
+    for g in sorted(names, key=lambda id: (len(id), id)):
+        try:
+            all_stats[names[g]] = {**all_ratings[g], **all_play_stats[g]}
+        except KeyError:
+            pass
 
     return all_stats
 
@@ -54,16 +61,208 @@ def print_stats(game_stats):
 
 def player_count_stats(game_id, play_limit=100):
     """Calculate plays per player count."""
-    plays = bgg_core.read_data(game_id, "plays", bgg_time.get_plays)
+    columns = bgg_time.read_play_columns(game_id)
+    counted = (columns["players"] > 0) & (columns["quantity"] < play_limit)
+    plays = np.bincount(columns["players"][counted], weights=columns["quantity"][counted])
 
     player_count_stats = collections.defaultdict(int)
-    for play in plays.values():
-        if play["players"] and (play["quantity"] < play_limit):
-            player_count_stats[play["players"]] += play["quantity"]
+    for players in np.flatnonzero(plays):
+        player_count_stats[int(players)] = int(plays[players])
 
     return player_count_stats
 
 
+def user_plays(columns, play_limit=100, time_limit=500, users_path="users"):
+    """
+    Sum plays of each user from play columns.
+    Returns a dict of arrays sorted by the user's id in the shared user table:
+    plays logged, minutes played and average player count, which is NaN for
+    users who never logged one. Users without a known username are dropped.
+    """
+    starts = bgg_time.group_starts(columns["user"])
+    if not len(starts):
+        empty = np.zeros((0,))
+        return {"user": np.zeros((0,), dtype=np.int32), "plays": empty, "time": empty,
+                "players": empty}
+
+    quantity = columns["quantity"].astype(np.int64)
+    length = columns["length"].astype(np.int64)
+    players = columns["players"].astype(np.int64)
+    counted = quantity < play_limit
+    timed = counted & (length > 0) & (length < time_limit)
+    with_players = counted & (players > 0)
+
+    plays = np.add.reduceat(np.where(counted, quantity, 0), starts)
+    time = np.add.reduceat(np.where(timed, length, 0), starts)
+    player_plays = np.add.reduceat(np.where(with_players, quantity, 0), starts)
+    player_sum = np.add.reduceat(np.where(with_players, players * quantity, 0), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_players = player_sum / player_plays
+
+    users = bgg_time.play_users({"user": columns["user"][starts]}, users_path=users_path)
+    keep = (users >= 0) & (plays > 0)
+    order = np.argsort(users[keep], kind="stable")
+    return {
+        "user": users[keep][order],
+        "plays": plays[keep][order].astype(np.float64),
+        "time": time[keep][order].astype(np.float64),
+        "players": avg_players[keep][order],
+    }
+
+
+def join_ratings(ratings, plays):
+    """
+    Join ratings with plays of the same users.
+    Takes sorted user ids and ratings of a game, such as from
+    RatingStore.ratings, and a dict from user_plays. Returns the ratings with
+    each rater's plays, time and average player count, which are 0, 0 and NaN
+    for raters who logged no plays.
+    """
+    indices, data = ratings
+    positions = np.searchsorted(plays["user"], indices)
+    found = positions < len(plays["user"])
+    found[found] = plays["user"][positions[found]] == indices[found]
+
+    joined = {"rating": np.asarray(data, dtype=np.float64), "matched": found}
+    for name, missing in [("plays", 0), ("time", 0), ("players", np.nan)]:
+        values = np.full((len(indices),), missing, dtype=np.float64)
+        values[found] = plays[name][positions[found]]
+        joined[name] = values
+    return joined
+
+
+def rating_bins(values, ratings, edges):
+    """
+    Get the count and sum of ratings in each bin of values, given the lower
+    edge of each bin. Values below the first edge or NaN are left out.
+    """
+    keep = values >= edges[0]
+    bins = np.searchsorted(edges, values[keep], side="right") - 1
+    counts = np.bincount(bins, minlength=len(edges))
+    sums = np.bincount(bins, weights=ratings[keep], minlength=len(edges))
+    return counts, sums
+
+
+def moments(x, y):
+    """Get the sums needed to combine correlations of x and y across games."""
+    return np.array([len(x), x.sum(), y.sum(), (x * x).sum(), (y * y).sum(), (x * y).sum()])
+
+
+def joined_sums(game_id, store=None, play_limit=100, time_limit=500, users_path="users"):
+    """
+    Get sums relating a game's ratings to the plays of the same users.
+    Sums for several games can be added together and summarized with
+    joined_summary, so that catalog-wide stats need no second pass.
+    """
+    if store is None:
+        store = bgg_store.RatingStore(users_path=users_path)
+    plays = user_plays(bgg_time.read_play_columns(game_id), play_limit, time_limit, users_path)
+    joined = join_ratings(store.ratings(game_id), plays)
+    rating = joined["rating"]
+
+    sums = {"raters": len(rating), "matched": int(joined["matched"].sum())}
+    for name, edges in [("plays", play_bins), ("time", time_bins)]:
+        sums[name] = rating_bins(joined[name], rating, edges)
+        sums[name + "_moments"] = moments(np.log1p(joined[name]), rating)
+    sums["players"] = rating_bins(np.round(joined["players"]), rating, player_bins)
+    return sums
+
+
+def add_sums(all_sums):
+    """Add up sums from joined_sums for several games."""
+    total = {}
+    for sums in all_sums:
+        for name, value in sums.items():
+            if isinstance(value, tuple):
+                value = tuple(np.add(a, b) for a, b in zip(total[name], value)) \
+                    if name in total else value
+            elif name in total:
+                value = total[name] + value
+            total[name] = value
+    return total
+
+
+def correlation(moments):
+    """Get the Pearson correlation from sums of x, y and their squares and product."""
+    n, sx, sy, sxx, syy, sxy = moments
+    cov = n * sxy - sx * sy
+    var = (n * sxx - sx * sx) * (n * syy - sy * sy)
+    return float(cov / np.sqrt(var)) if var > 0 else float("nan")
+
+
+def bin_labels(edges, last="+"):
+    """Label bins given their lower edges, such as 3-4 for integer edges 3 and 5."""
+    labels = []
+    for low, high in zip(edges, edges[1:] + [None]):
+        if high is None:
+            labels.append("%d%s" % (low, last))
+        elif high - low == 1:
+            labels.append("%d" % low)
+        else:
+            labels.append("%d-%d" % (low, high - 1))
+    return labels
+
+
+def joined_summary(sums):
+    """
+    Summarize joined sums into a flat dict of stats: numbers of raters and of
+    raters who logged plays, average rating in each bin of plays, minutes
+    played and player count, and correlations of rating with log plays and
+    log minutes played.
+    """
+    stats = {"raters": int(sums["raters"]), "matched": int(sums["matched"])}
+    stats["plays_corr"] = correlation(sums["plays_moments"])
+    stats["time_corr"] = correlation(sums["time_moments"])
+    for name, edges in [("plays", play_bins), ("time", time_bins), ("players", player_bins)]:
+        counts, rating_sums = sums[name]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = rating_sums / counts
+        for label, count, mean in zip(bin_labels(edges), counts, means):
+            stats["rating_%s_%s" % (name, label)] = float(mean)
+            stats["count_%s_%s" % (name, label)] = int(count)
+    return stats
+
+
+def joined_stats(ids=None, workers=None, resolve=False, users_path="users"):
+    """
+    Relate ratings to plays for each game and across all of them.
+    By default, every game with both plays downloaded and ratings in the
+    rating store is used. With resolve, usernames of players not seen before
+    are looked up first, otherwise only players already in the user table are
+    matched. Returns a dict of stats for each game id, and for "all".
+    """
+    store = bgg_store.RatingStore(users_path=users_path)
+    if ids is None:
+        ids = [game_id for game_id in bgg_core.downloaded_ids("plays") if game_id in store]
+    ids = list(ids)
+
+    if resolve:
+        userids = [np.unique(bgg_time.read_play_columns(game_id)["user"]) for game_id in ids]
+        if userids:
+            bgg_users.open_table(users_path).resolve(np.unique(np.concatenate(userids)))
+
+    all_sums = bgg_core.map_games(
+        functools.partial(joined_sums, users_path=users_path), ids, workers)
+    stats = {game_id: joined_summary(sums) for game_id, sums in zip(ids, all_sums)}
+    if all_sums:
+        stats["all"] = joined_summary(add_sums(all_sums))
+    return stats
+
+
+def print_joined_stats(stats):
+    """Print average ratings by plays, time played and player count."""
+    print("Raters: %d, with logged plays: %d" % (stats["raters"], stats["matched"]))
+    print("Correlation of rating with log plays: %.3f, with log time played: %.3f"
+          % (stats["plays_corr"], stats["time_corr"]))
+    for name, title in [("plays", "Plays"), ("time", "Minutes played"),
+                        ("players", "Player count")]:
+        print("%s\tRaters\tAverage rating" % title)
+        for key, value in stats.items():
+            if key.startswith("rating_%s_" % name) and stats["count" + key[6:]]:
+                print("%s\t%d\t%.2f" % (key[len(name) + 8:], stats["count" + key[6:]], value))
+    print()
+
+
 if __name__ == "__main__":
     # Ask for game to analyze.
     try:
@@ -0,0 +1,239 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import bgg_compare
+import bgg_core
+import bgg_parse
+
+RATINGS_PER_PAGE = 100
+
+
+def get_ratings_page(game_id, page):
+    """Get the total number of ratings and a page of (username, rating) pairs."""
+    query_dict = {"id": game_id, "ratingcomments": 1, "pagesize": RATINGS_PER_PAGE,
+                  "page": page}
+    parsed = bgg_core.fetch_page("thing", query_dict, 3, parse=bgg_parse.parse_ratings)
+    return parsed if parsed is not None else (None, [])
+
+
+class RatingSample(object):
+    """
+    Ratings of several games from a random sample of their rating pages.
+
+    The first page of each game is fetched to learn its number of pages, and
+    pages are then taken in a random order, so every rating, and every pair of
+    ratings from a user who rated two games, is equally likely to be in the
+    sample. The first page is only used once its turn comes in that order.
+    """
+
+    def __init__(self, ids, seed=None, workers=4):
+        self.ids = [str(game_id) for game_id in ids]
+        self.rng = np.random.default_rng(seed)
+        self.workers = workers
+        self.ratings = [{} for _ in self.ids]
+
+        first_pages = self._fetch([(i, 1) for i in range(len(self.ids))])
+        self.totals = [total or 0 for total, _ in first_pages]
+        self.first_pages = [ratings for _, ratings in first_pages]
+        self.pages = [max(1, math.ceil(total / RATINGS_PER_PAGE)) for total in self.totals]
+        self.order = [1 + self.rng.permutation(pages) for pages in self.pages]
+        self.fetched = [0 for _ in self.ids]
+
+    def _fetch(self, pages):
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(lambda item: get_ratings_page(self.ids[item[0]], item[1]),
+                                     pages))
+
+    def fetch(self, fraction):
+        """Fetch more pages of each game until fraction of its pages are sampled."""
+        pages = []
+        for i, order in enumerate(self.order):
+            target = min(len(order), max(1, math.ceil(fraction * len(order))))
+            pages += [(i, int(page)) for page in order[self.fetched[i]:target]]
+            self.fetched[i] = max(self.fetched[i], target)
+
+        fetched = iter(self._fetch([(i, page) for i, page in pages if page != 1]))
+        for i, page in pages:
+            ratings = self.first_pages[i] if page == 1 else next(fetched)[1]
+            self.ratings[i].update((user, float(rating)) for user, rating in ratings)
+
+    @property
+    def fraction(self):
+        """Fraction of all rating pages of the games fetched so far."""
+        return sum(self.fetched) / sum(self.pages)
+
+    @property
+    def complete(self):
+        return self.fetched == self.pages
+
+    def matrix(self):
+        """Get a games x users matrix of sampled ratings, with NaN for missing ratings."""
+        return bgg_compare.user_game_matrix(self.ratings)
+
+
+def bootstrap_sums(user_game_mat, stat, num_boot=1000, seed=None, max_cells=2 ** 22):
+    """
+    Sum a per-user statistic over bootstrap resamples of users.
+    Takes a games x users matrix and a function mapping a block of its columns
+    to a rows x users array. Users are weighted by Poisson(1) counts, which for
+    many users matches resampling them with replacement while letting users be
+    processed in blocks. Returns a resamples x rows array of weighted sums.
+    """
+
+    rng = np.random.default_rng(seed)
+    num_users = user_game_mat.shape[1]
+    block_size = max(1, max_cells // num_boot)
+    sums = None
+
+    for start in range(0, num_users, block_size):
+        values = stat(user_game_mat[:, start:start + block_size]).astype(np.float32)
+        weights = rng.poisson(1.0, (num_boot, values.shape[1])).astype(np.float32)
+        block_sums = weights @ values.T
+        sums = block_sums if sums is None else sums + block_sums
+
+    return sums
+
+
+def percentile_interval(samples, confidence=0.95):
+    """Get lower and upper percentile bounds of bootstrap samples along the first axis."""
+    alpha = 100 * (1 - confidence) / 2
+    return np.nanpercentile(samples, alpha, axis=0), np.nanpercentile(samples, 100 - alpha, axis=0)
+
+
+def average_intervals(user_game_mat, confidence=0.95, num_boot=1000, seed=None):
+    """
+    Compare average ratings among users who rated every game, with bootstrap
+    confidence intervals.
+    Returns a dict of the number of common users, the average rating of each
+    game with the bounds of its interval, and the ranking of game positions by
+    average with bounds of the difference between each game and the next.
+    """
+
+    common = user_game_mat[:, ~np.any(np.isnan(user_game_mat), axis=0)]
+    num_games, num_users = common.shape
+    if not num_users:
+        return {"users": 0, "resolved": False}
+
+    means = common.mean(axis=1)
+    order = np.argsort(-means, kind="stable")
+    sums = bootstrap_sums(common, lambda block: np.vstack([block, np.ones((1, block.shape[1]))]),
+                          num_boot, seed)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        boot_means = sums[:, :num_games] / sums[:, num_games:]
+    low, high = percentile_interval(boot_means, confidence)
+    diff_low, _ = percentile_interval(boot_means[:, order[:-1]] - boot_means[:, order[1:]],
+                                      confidence)
+
+    return {
+        "users": num_users,
+        "means": means,
+        "low": low,
+        "high": high,
+        "order": order,
+        "diff_low": diff_low,
+        "resolved": bool(np.all(diff_low > 0)),
+    }
+
+
+def preference_intervals(user_game_mat, pairs, confidence=0.95, num_boot=1000, seed=None):
+    """
+    Get the share of users preferring the first game of each pair, among users
+    who rated both games differently, with bootstrap confidence intervals.
+    Takes a games x users matrix and a list of (i, j) pairs of game positions.
+    Returns arrays of the share, its lower and upper bounds and the number of
+    users counted for each pair.
+    """
+
+    if not pairs:
+        empty = np.zeros((0,))
+        return empty, empty, empty, empty.astype(np.int64)
+    first, second = np.array(pairs).T
+
+    def stat(block):
+        # NaN never compares greater, so users missing a game are not counted.
+        return np.vstack([block[first] > block[second], block[second] > block[first]])
+
+    wins = np.count_nonzero(user_game_mat[first] > user_game_mat[second], axis=1)
+    losses = np.count_nonzero(user_game_mat[second] > user_game_mat[first], axis=1)
+    sums = bootstrap_sums(user_game_mat, stat, num_boot, seed)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = wins / (wins + losses)
+        boot_share = sums[:, :len(pairs)] / (sums[:, :len(pairs)] + sums[:, len(pairs):])
+    low, high = percentile_interval(boot_share, confidence)
+    return share, low, high, wins + losses
+
+
+def sampled(ids, analyze, first_fraction=1 / 16, max_fraction=1.0, seed=None, workers=4):
+    """
+    Fetch growing random samples of rating pages until analyze resolves them.
+    Takes game ids and a function mapping a RatingSample to a result dict with
+    a "resolved" entry. The sampled fraction of pages doubles each round until
+    the result is resolved, max_fraction is reached or every page is fetched.
+    Returns the last result, with the sampled fraction of pages added.
+    """
+
+    sample = RatingSample(ids, seed, workers)
+    fraction = first_fraction
+    while True:
+        sample.fetch(fraction)
+        result = analyze(sample)
+        print("Sampled %.1f%% of %d rating pages, %s"
+              % (100 * sample.fraction, sum(sample.pages),
+                 "resolved" if result["resolved"] else "not resolved"))
+        if result["resolved"] or sample.complete or fraction >= max_fraction:
+            break
+        fraction = min(2 * fraction, max_fraction)
+
+    result["fraction"] = sample.fraction
+    result["complete"] = sample.complete
+    return result
+
+
+def sample_compare(ids, confidence=0.95, num_boot=1000, seed=None, **kwargs):
+    """
+    Compare average ratings among common users from a sample of rating pages.
+    Sampling stops once the bootstrap interval of the difference between each
+    game and the next in the ranking excludes zero. Takes keyword arguments of
+    sampled. Returns the result of average_intervals.
+    """
+
+    def analyze(sample):
+        return average_intervals(sample.matrix(), confidence, num_boot, seed)
+
+    return sampled(ids, analyze, seed=seed, **kwargs)
+
+
+def sample_rank(ids, methods=("condorcet_irv",), confidence=0.95, num_boot=1000, seed=None,
+                **kwargs):
+    """
+    Rank games with each method from a sample of rating pages.
+    Sampling stops once, in every ranking, the bootstrap interval of the share
+    of users preferring each game to the next excludes one half. Takes keyword
+    arguments of sampled. Returns a dict with a dict for each method of the
+    ranking and the share of users preferring each game to the next, with the
+    bounds of its interval.
+    """
+
+    ids = [str(game_id) for game_id in ids]
+    position = {game_id: i for i, game_id in enumerate(ids)}
+
+    def analyze(sample):
+        user_game_mat = sample.matrix()
+        wins = bgg_compare.pairwise_wins(user_game_mat)
+        result = {"resolved": True}
+        for method in methods:
+            if method == "condorcet_irv":
+                ranking = bgg_compare.condorcet_irv_matrix(user_game_mat, sample.totals, ids)
+            else:
+                ranking = bgg_compare.rank_pairwise(wins, ids, method)
+            pairs = [(position[a], position[b]) for a, b in zip(ranking, ranking[1:])]
+            share, low, high, users = preference_intervals(user_game_mat, pairs, confidence,
+                                                           num_boot, seed)
+            result[method] = {"ranking": ranking, "share": share, "low": low, "high": high,
+                              "users": users}
+            result["resolved"] &= bool(np.all((low > 0.5) | (high < 0.5)))
+        return result
+
+    return sampled(ids, analyze, seed=seed, **kwargs)
@@ -0,0 +1,291 @@
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+import bgg_users
+
+
+class RatingStore(object):
+    """
+    Sparse games x users rating matrix stored on disk in CSR layout.
+
+    Each game is a row of sorted integer user ids and float32 ratings. Rows are
+    only ever appended, so games can be added one at a time as they are
+    downloaded, and stores opened elsewhere keep reading the right rows;
+    updating a game appends a new row and orphans the old one until compact is
+    called. A row is appended to the ratings first and to indptr and
+    games.json last, so ratings left past the end of the last row by an
+    interrupted add are dropped when the store is opened. The arrays are
+    memory-mapped when read. User ids are the dense ids of the user table at
+    users_path, which plays share.
+    """
+
+    def __init__(self, path="ratings_store", users_path="users"):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.table = bgg_users.open_table(users_path)
+        self._finish_commit()
+
+        # Row of each game id in the CSR arrays.
+        try:
+            with open(self._file("games.json")) as f:
+                self.games = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            self.games = {}
+
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self._file("indptr.i8")):
+            np.zeros((1,), dtype=np.int64).tofile(self._file("indptr.i8"))
+        self._truncate()
+
+    def _truncate(self):
+        """Drop whatever an interrupted add wrote past the end of the last complete row."""
+        for name in ["indices.i4", "data.f4"]:
+            if not os.path.exists(self._file(name)):
+                open(self._file(name), "wb").close()
+
+        itemsize = np.dtype(np.int64).itemsize
+        size = os.path.getsize(self._file("indptr.i8"))
+        if size % itemsize:
+            with open(self._file("indptr.i8"), "rb+") as f:
+                f.truncate(size - size % itemsize)
+
+        # Rows whose ratings didn't make it to disk are dropped along with them.
+        stored = min(os.path.getsize(self._file("indices.i4")) // 4,
+                     os.path.getsize(self._file("data.f4")) // 4)
+        indptr = np.array(self.indptr)
+        rows = max(1, np.searchsorted(indptr, stored, side="right"))
+        if rows < len(indptr):
+            with open(self._file("indptr.i8"), "rb+") as f:
+                f.truncate(rows * itemsize)
+            self.games = {game_id: row for game_id, row in self.games.items() if row < rows - 1}
+            self._write_games()
+
+        end = int(indptr[rows - 1])
+        for name in ["indices.i4", "data.f4"]:
+            if os.path.getsize(self._file(name)) > 4 * end:
+                with open(self._file(name), "rb+") as f:
+                    f.truncate(4 * end)
+
+    @property
+    def users(self):
+        """Usernames in order of their integer ids."""
+        return self.table.names
+
+    @property
+    def user_ids(self):
+        """Integer id of each username."""
+        return self.table.index
+
+    def _commit(self, names):
+        """
+        Move new versions of files, written to <name>.new, into place. The
+        files are listed in commit.json first, so that if the process stops
+        partway, the next open finishes moving them.
+        """
+        with open(self._file("commit.json.tmp"), "w") as f:
+            json.dump({"replace": list(names)}, f)
+        os.replace(self._file("commit.json.tmp"), self._file("commit.json"))
+        self._finish_commit()
+
+    def _finish_commit(self):
+        """Finish moving the files of a commit, if one was interrupted."""
+        try:
+            with open(self._file("commit.json")) as f:
+                commit = json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return
+
+        for name in commit["replace"]:
+            if os.path.exists(self._file(name + ".new")):
+                os.replace(self._file(name + ".new"), self._file(name))
+        os.remove(self._file("commit.json"))
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _array(self, name, dtype):
+        """Memory-map one of the CSR arrays."""
+        filename = self._file(name)
+        if not os.path.getsize(filename):
+            return np.zeros((0,), dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode="r")
+
+    @property
+    def indptr(self):
+        return self._array("indptr.i8", np.int64)
+
+    @property
+    def indices(self):
+        return self._array("indices.i4", np.int32)
+
+    @property
+    def data(self):
+        return self._array("data.f4", np.float32)
+
+    def __contains__(self, game_id):
+        return str(game_id) in self.games
+
+    def __len__(self):
+        return len(self.games)
+
+    def add(self, game_id, ratings):
+        """Append ratings for a game, given a dict of user-rating pairs."""
+        with self.lock:
+            self._add(game_id, ratings)
+
+    def _add(self, game_id, ratings):
+        indices = self.table.intern(ratings)
+        data = np.array(list(ratings.values()), dtype=np.float32)
+        order = np.argsort(indices)
+
+        with open(self._file("indices.i4"), "ab") as f:
+            indices[order].tofile(f)
+        with open(self._file("data.f4"), "ab") as f:
+            data[order].tofile(f)
+        indptr = self.indptr
+        with open(self._file("indptr.i8"), "ab") as f:
+            np.array([indptr[-1] + len(indices)], dtype=np.int64).tofile(f)
+
+        self.games[str(game_id)] = len(indptr) - 1
+        self._write_games()
+
+    def _write_games(self, filename="games.json"):
+        with open(self._file(filename + ".tmp"), "w") as f:
+            json.dump(self.games, f)
+        os.replace(self._file(filename + ".tmp"), self._file(filename))
+
+    def ratings(self, game_id):
+        """Get arrays of user ids and ratings for a game."""
+        row = self.games[str(game_id)]
+        indptr = self.indptr
+        start, end = indptr[row], indptr[row + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def ratings_dict(self, game_id):
+        """Get ratings for a game as a dict of user-rating pairs."""
+        indices, data = self.ratings(game_id)
+        return {self.users[i]: float(r) for i, r in zip(indices, data)}
+
+    def counts(self, ids):
+        """Get the number of ratings for each game."""
+        indptr = self.indptr
+        rows = np.array([self.games[str(i)] for i in ids], dtype=np.intp)
+        return indptr[rows + 1] - indptr[rows]
+
+    def averages(self, ids):
+        """Get the average rating for each game."""
+        return np.array([np.mean(self.ratings(i)[1], dtype=np.float64) for i in ids])
+
+    def matrix(self, ids):
+        """
+        Build a dense games x users matrix of ratings for the given games.
+        Only users who rated at least one of the games get a column.
+        Returns the float32 matrix, with NaN for missing ratings, and the user ids
+        of its columns.
+        """
+
+        rows = [self.ratings(i) for i in ids]
+        if rows:
+            users = np.unique(np.concatenate([indices for indices, _ in rows]))
+        else:
+            users = np.zeros((0,), dtype=np.int32)
+
+        user_game_mat = np.full((len(rows), len(users)), np.nan, dtype=np.float32)
+        for i, (indices, data) in enumerate(rows):
+            user_game_mat[i, np.searchsorted(users, indices)] = data
+
+        return user_game_mat, users
+
+    def common_ratings(self, ids):
+        """
+        Get ratings from users who rated every one of the given games.
+        Rows are intersected by binary search, starting from the game with the
+        fewest ratings. Returns the sorted user ids and a games x users float32
+        matrix of their ratings.
+        """
+
+        rows = [self.ratings(i) for i in ids]
+        users = np.array(min((indices for indices, _ in rows), key=len))
+        for indices, _ in rows:
+            positions = np.searchsorted(indices, users)
+            found = positions < len(indices)
+            found[found] = indices[positions[found]] == users[found]
+            users = users[found]
+
+        user_game_mat = np.empty((len(rows), len(users)), dtype=np.float32)
+        for i, (indices, data) in enumerate(rows):
+            user_game_mat[i] = data[np.searchsorted(indices, users)]
+
+        return users, user_game_mat
+
+    def by_user(self, ids, users=None):
+        """
+        Get the ratings of the given games in user-major (CSC) order.
+        If a sorted array of user ids is given, only their ratings are kept.
+        Returns arrays of user ids, positions of games in ids and ratings,
+        sorted by user id and then game position.
+        """
+
+        rows = [self.ratings(i) for i in ids]
+        if users is not None:
+            masks = [np.isin(indices, users, assume_unique=True) for indices, _ in rows]
+            rows = [(indices[mask], data[mask]) for (indices, data), mask in zip(rows, masks)]
+        users = np.concatenate([indices for indices, _ in rows] or [np.zeros((0,), np.int32)])
+        games = np.repeat(np.arange(len(rows), dtype=np.int32),
+                          [len(indices) for indices, _ in rows])
+        ratings = np.concatenate([data for _, data in rows] or [np.zeros((0,), np.float32)])
+
+        # Rows are concatenated in game order, so a stable sort keeps it per user.
+        order = np.argsort(users, kind="stable")
+        return users[order], games[order], ratings[order]
+
+    def checksum(self, game_id):
+        """Get a checksum of the ratings for a game, which changes when they are updated."""
+        indices, data = self.ratings(game_id)
+        return zlib.crc32(np.ascontiguousarray(data), zlib.crc32(np.ascontiguousarray(indices)))
+
+    def orphaned(self):
+        """Get the fraction of stored ratings in rows orphaned by updates."""
+        stored = int(self.indptr[-1])
+        return 1 - int(np.sum(self.counts(self.games))) / stored if stored else 0.0
+
+    def compact(self):
+        """
+        Rewrite the store without rows orphaned by updates.
+        Rows are renumbered, so this should only be run while the store isn't
+        open anywhere else.
+        """
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        indptr = self.indptr
+        indices = self.indices
+        data = self.data
+
+        new_indptr = [0]
+        new_games = {}
+        chunks = []
+        for game_id, row in sorted(self.games.items(), key=lambda item: item[1]):
+            start, end = indptr[row], indptr[row + 1]
+            chunks.append((np.array(indices[start:end]), np.array(data[start:end])))
+            new_games[game_id] = len(new_indptr) - 1
+            new_indptr.append(new_indptr[-1] + end - start)
+        del indptr, indices, data
+
+        with open(self._file("indices.i4.new"), "wb") as f:
+            for chunk, _ in chunks:
+                chunk.tofile(f)
+        with open(self._file("data.f4.new"), "wb") as f:
+            for _, chunk in chunks:
+                chunk.tofile(f)
+        np.array(new_indptr, dtype=np.int64).tofile(self._file("indptr.i8.new"))
+
+        self.games = new_games
+        self._write_games("games.json.new")
+        self._commit(["indices.i4", "data.f4", "indptr.i8", "games.json"])
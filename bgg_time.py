@@ -1,76 +1,222 @@
-import glob
 import os
-from datetime import datetime
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
 
 import bgg_core
+import bgg_parse
+import bgg_users
+
+# Days before the newest downloaded play to fetch again when updating plays.
+play_lookback_days = 30
 
 
-def get_plays(id):
-    """Get plays for game with given id."""
+def get_plays(id, sync=None):
+    """
+    Get plays for game with given id, newest first.
+    If a sync dict from a previous download is given, only plays dated from
+    shortly before the newest play seen are fetched. The dict is updated with
+    the newest play seen and the page being yielded, and sync["next_page"]
+    resumes from a later page.
+    """
 
     query_dict = {"id": id, "pagesize": 100}
+    if sync is None:
+        sync = {}
+    if "date" in sync:
+        # Plays are often logged some time after they are played.
+        mindate = date.fromisoformat(sync["date"]) - timedelta(days=play_lookback_days)
+        query_dict["mindate"] = mindate.isoformat()
 
-    for page, soup in bgg_core.pager("plays", query_dict, 3):
+    for page, (total, plays) in bgg_core.pager("plays", query_dict, 3,
+                                               parse=bgg_parse.parse_plays,
+                                               first_page=sync.get("next_page", 1)):
 
-        tags = soup.find_all("play")
-        if not tags:
+        # With mindate the total only counts the new plays.
+        if total is not None and "mindate" not in query_dict:
+            sync["total"] = total
+        sync["page"] = page - 1
+
+        if not plays:
             break
-        for tag in tags:
-            play_dict = {}
-            play_dict["userid"] = tag["userid"]
-            play_dict["date"] = tag["date"]
-            play_dict["length"] = int(tag["length"])
-            play_dict["quantity"] = int(tag["quantity"])
-            play_dict["players"] = int(len(tag.find_all("player")))
-            yield tag["id"], play_dict
-            more_pages = True
+        for play_id, play_dict in plays:
+            if int(play_id) > sync.get("id", 0):
+                sync["id"] = int(play_id)
+            if play_dict["date"] > sync.get("date", ""):
+                try:
+                    date.fromisoformat(play_dict["date"])
+                    sync["date"] = play_dict["date"]
+                except ValueError:
+                    pass
+            yield play_id, play_dict
 
         print("Parsed plays page %s for game id %s" % (page, id))
 
 
+def date_columns(dates):
+    """
+    Parse YYYY-MM-DD strings into arrays of years and days since 1970-01-01.
+    Invalid dates get year 0.
+    """
+    raw = np.array(dates, dtype="S10").view(np.uint8).reshape(len(dates), 10)
+    digits = raw[:, [0, 1, 2, 3, 5, 6, 8, 9]].astype(np.int32) - ord("0")
+    valid = (np.all((digits >= 0) & (digits <= 9), axis=1)
+             & (raw[:, 4] == ord("-")) & (raw[:, 7] == ord("-")))
+
+    year = digits[:, :4] @ np.array([1000, 100, 10, 1], dtype=np.int32)
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    valid &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)
+    year[~valid] = 1970
+    month[~valid] = 1
+    day[~valid] = 1
+
+    first_of_month = (year - 1970).astype("M8[Y]").astype("M8[M]") + (month - 1)
+    days = first_of_month.astype("M8[D]") + (day - 1)
+    # Reject days past the end of the month.
+    valid &= days.astype("M8[M]") == first_of_month
+
+    days = days.astype(np.int32)
+    year[~valid] = 0
+
+    # Dates not in the fixed-width form may still parse, e.g. unpadded months.
+    for i in np.flatnonzero(~valid):
+        try:
+            parsed = datetime.strptime(dates[i], "%Y-%m-%d").date()
+        except ValueError:
+            continue
+        year[i] = parsed.year
+        days[i] = (parsed - date(1970, 1, 1)).days
+
+    return year, days
+
+
+def play_columns(plays):
+    """
+    Convert an iterable of play dicts into a dict of column arrays.
+    Rows are sorted by user, year and date so that each user's plays, and each
+    user's plays within a year, are contiguous.
+    """
+    fields = ["userid", "date", "length", "quantity", "players"]
+    values = {field: [] for field in fields}
+    for play in plays:
+        for field in fields:
+            values[field].append(play[field])
+
+    year, days = date_columns(values["date"])
+    columns = {
+        "user": np.array(values["userid"], dtype=np.int32),
+        "year": year,
+        "date": days,
+        "length": np.array(values["length"], dtype=np.int32),
+        "quantity": np.array(values["quantity"], dtype=np.int32),
+        "players": np.array(values["players"], dtype=np.int32),
+    }
+    order = np.lexsort((columns["date"], columns["year"], columns["user"]))
+    return {name: column[order] for name, column in columns.items()}
+
+
+def read_play_columns(game_id, update=False):
+    """
+    Read plays for game as a dict of column arrays.
+    Columns are cached next to the plays data file and rebuilt when it changes.
+    The cache is replaced atomically, so an interrupted write leaves no corrupt file.
+    """
+    if update or not os.path.exists(bgg_core.data_path(game_id, "plays")):
+        bgg_core.read_data(game_id, "plays", get_plays, update=update)
+    filename = bgg_core.data_path(game_id, "plays")
+    columns_file = "plays/%s.npz" % game_id
+
+    if not os.path.exists(columns_file) or \
+            os.path.getmtime(columns_file) < os.path.getmtime(filename):
+        columns = play_columns(play for _, play in bgg_core.iter_data(game_id, "plays"))
+        temp_file = "%s.%d.%d.tmp" % (columns_file, os.getpid(), threading.get_ident())
+        with open(temp_file, "wb") as f:
+            np.savez(f, **columns)
+        os.replace(temp_file, columns_file)
+        return columns
+
+    with np.load(columns_file) as npz:
+        return dict(npz)
+
+
+def play_users(columns, resolve=False, workers=4, users_path="users"):
+    """
+    Get the dense id in the shared user table of the user of each play, the
+    same ids ratings are stored with, or -1 for users without a known username.
+    With resolve, usernames of users not seen before are looked up first.
+    """
+    table = bgg_users.open_table(users_path)
+    if resolve:
+        return table.resolve(columns["user"], workers)
+    return table.lookup(columns["user"])
+
+
+def group_starts(*columns):
+    """Get the start index of each run of equal rows across sorted columns."""
+    if not len(columns[0]):
+        return np.zeros((0,), dtype=np.intp)
+    changed = np.zeros((len(columns[0]),), dtype=bool)
+    changed[0] = True
+    for column in columns:
+        changed[1:] |= column[1:] != column[:-1]
+    return np.flatnonzero(changed)
+
+
+def group_count(mask, starts):
+    """Count groups, given by their start indices, with any row in mask."""
+    if not len(starts):
+        return 0
+    return int(np.count_nonzero(np.logical_or.reduceat(mask, starts)))
+
+
 def play_stats(game_id, players=None, time_limit=500, play_limit=100, update=False):
     """Calculate play stats."""
-    plays = bgg_core.read_data(game_id, "plays", get_plays, update=update)
-
-    with bgg_core.PersistDict("yearpublished.json", bgg_core.get_game_year) as games:
-        yr_published = int(games[game_id])
-
-    plays_count = 0
-    users = []
-    user_years = []
-    user_year_plays_count = 0
-    time_sum = 0
-    timed_plays_count = 0
-    timed_users = []
-    for play in plays.values():
-        if play["quantity"] < play_limit:
-            plays_count += play["quantity"]
-            users.append(play["userid"])
-
-            try:
-                yr = datetime.strptime(play["date"], "%Y-%m-%d").year
-                if yr >= yr_published:
-                    user_years.append((yr, play["userid"]))
-                    user_year_plays_count += play["quantity"]
-            except ValueError:
-                pass
-
-            if 0 < play["length"] < time_limit:
-                if players and (int(players) != play["players"]):
-                    continue
-                time_sum += play["length"]
-                timed_plays_count += play["quantity"]
-                timed_users.append(play["userid"])
-
-    users_count = len(set(users))
+    return play_stats_by_players(game_id, [players], time_limit, play_limit, update)[players]
+
+
+def play_stats_by_players(game_id, player_counts=None, time_limit=500, play_limit=100,
+                          update=False):
+    """
+    Calculate play stats for several player count filters in one pass.
+    Returns a dict mapping each player count to its stats, where a count of
+    None keeps all plays. By default, stats are calculated with no filter and
+    for each player count with timed plays.
+    """
+    columns = read_play_columns(game_id, update=update)
+    yr_published = int(bgg_core.get_game_year(game_id))
+
+    quantity = columns["quantity"]
+    length = columns["length"]
+    user_starts = group_starts(columns["user"])
+    user_year_starts = group_starts(columns["user"], columns["year"])
+
+    counted = quantity < play_limit
+    plays_count = int(quantity[counted].sum())
+    users_count = group_count(counted, user_starts)
+    in_years = counted & (columns["year"] > 0) & (columns["year"] >= yr_published)
+    user_year_plays_count = int(quantity[in_years].sum())
+    user_years_count = group_count(in_years, user_year_starts)
+
     avg_plays = plays_count / users_count
-    user_years_count = len(set(user_years))
     avg_plays_per_yr = user_year_plays_count / user_years_count
-    timed_users_count = len(set(timed_users))
-    avg_time = float(time_sum) / timed_plays_count
-    avg_time_per_user = float(time_sum) / timed_users_count
 
-    return {
+    timed = counted & (length > 0) & (length < time_limit)
+    if player_counts is None:
+        player_counts = [None] + [int(p) for p in np.unique(columns["players"][timed]) if p]
+
+    stats = {}
+    for players in player_counts:
+        mask = timed & (columns["players"] == int(players)) if players else timed
+        time_sum = int(length[mask].sum())
+        timed_plays_count = int(quantity[mask].sum())
+        timed_users_count = group_count(mask, user_starts)
+
+        avg_time = float(time_sum) / timed_plays_count
+        avg_time_per_user = float(time_sum) / timed_users_count
+
+        stats[players] = {
             "plays_count": plays_count,
             "users_count": users_count,
             "avg_plays": avg_plays,
@@ -82,13 +228,21 @@ def play_stats(game_id, players=None, time_limit=500, play_limit=100, update=Fal
             "avg_time_per_user": avg_time_per_user
             }
 
+    return stats
+
 
-def all_play_stats():
-    """Get all downloaded play stats."""
-    games_dict = {}
-    for f in glob.glob("plays/*.json"):
-        game_id = os.path.basename(os.path.splitext(f)[0])
-        games_dict[game_id] = play_stats(game_id)
+def all_play_stats(workers=None):
+    """
+    Get all downloaded play stats.
+    Stats are cached until a game's plays file changes, and recalculated on a
+    pool of worker processes.
+    """
+    ids = bgg_core.downloaded_ids("plays")
+    # Fetch years published for all games in a few batched requests.
+    bgg_core.get_games_info(ids)
+    with bgg_core.SummaryCache("plays_summary.json", "plays") as cache:
+        games_dict = cache.map(play_stats, ids, workers)
+        cache.report()
     return games_dict
 
 
@@ -0,0 +1,152 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import bgg_core
+
+tables = {}
+tables_lock = threading.Lock()
+
+
+def open_table(path="users"):
+    """Get the user table at path, shared by everything in the process using it."""
+    path = os.path.abspath(path)
+    with tables_lock:
+        if path not in tables:
+            tables[path] = UserTable(path)
+        return tables[path]
+
+
+class UserTable(object):
+    """
+    Usernames interned as dense integer ids, shared by ratings and plays.
+
+    Usernames get the next integer id the first time they are seen and are
+    appended to names.txt, so ids never change. Plays only know BGG's numeric
+    user ids, which are resolved to usernames once, cached in userids.txt, and
+    mapped to the same dense ids, so ratings and plays of a user join on one
+    integer. Ids whose username can't be found are only remembered for the
+    life of the table, so they are tried again later. Use open_table rather
+    than creating tables directly, so that appends to the files are not
+    interleaved.
+    """
+
+    def __init__(self, path="users"):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lock = threading.Lock()
+        self._names = None
+        self._index = None
+        self._userids = None
+        self._sorted_userids = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def names(self):
+        """Usernames in order of their dense ids."""
+        if self._names is None:
+            try:
+                with open(self._file("names.txt"), encoding="utf-8") as f:
+                    self._names = f.read().splitlines()
+            except FileNotFoundError:
+                self._names = []
+        return self._names
+
+    @property
+    def index(self):
+        """Dense id of each username."""
+        if self._index is None:
+            self._index = {u: i for i, u in enumerate(self.names)}
+        return self._index
+
+    @property
+    def userids(self):
+        """Dense id of each resolved BGG user id, or -1 if no username was found."""
+        if self._userids is None:
+            self._userids = {}
+            try:
+                with open(self._file("userids.txt"), encoding="utf-8") as f:
+                    lines = [line.split("\t") for line in f.read().splitlines()]
+            except FileNotFoundError:
+                lines = []
+            # Older tables cached failed lookups with an empty name; skip them.
+            lines = [(userid, name) for userid, name in lines if name]
+            dense = self.intern([name for _, name in lines])
+            for (userid, _), i in zip(lines, dense):
+                self._userids[int(userid)] = i
+        return self._userids
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, usernames):
+        """Get an int32 array of dense ids for usernames, adding new ones."""
+        usernames = list(usernames)
+        with self.lock:
+            new_names = [u for u in dict.fromkeys(usernames) if u not in self.index]
+            if new_names:
+                for u in new_names:
+                    self.index[u] = len(self.names)
+                    self.names.append(u)
+                with open(self._file("names.txt"), "a", encoding="utf-8") as f:
+                    f.write("".join(u + "\n" for u in new_names))
+        return np.fromiter((self.index[u] for u in usernames), dtype=np.int32,
+                           count=len(usernames))
+
+    def lookup(self, userids):
+        """Get an int32 array of dense ids for BGG user ids, -1 for unresolved ones."""
+        userids = np.asarray(userids, dtype=np.int64)
+        known = self.userids
+        with self.lock:
+            if self._sorted_userids is None:
+                keys = np.fromiter(known, dtype=np.int64, count=len(known))
+                values = np.fromiter(known.values(), dtype=np.int32, count=len(known))
+                order = np.argsort(keys)
+                self._sorted_userids = keys[order], values[order]
+            keys, values = self._sorted_userids
+
+        if not len(keys):
+            return np.full(userids.shape, -1, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(keys, userids), len(keys) - 1)
+        return np.where(keys[positions] == userids, values[positions], -1).astype(np.int32)
+
+    def resolve(self, userids, workers=4):
+        """
+        Get an int32 array of dense ids for BGG user ids, resolving new ones.
+        Usernames of ids not seen before are looked up concurrently and cached.
+        Ids whose lookup fails map to -1 until the table is next opened.
+        """
+        missing = [int(u) for u in np.unique(np.asarray(userids, dtype=np.int64))
+                   if int(u) not in self.userids]
+        if missing:
+            with ThreadPoolExecutor(workers) as executor:
+                names = list(executor.map(get_username, missing))
+            self.add_userids(dict(zip(missing, names)))
+        return self.lookup(userids)
+
+    def add_userids(self, usernames):
+        """
+        Record the usernames of BGG user ids, given a dict with None for ones
+        that weren't found. Only found usernames are written to userids.txt.
+        """
+        usernames = {int(userid): name or "" for userid, name in usernames.items()}
+        known = self.userids
+        dense = iter(self.intern([name for name in usernames.values() if name]))
+        with self.lock:
+            for userid, name in usernames.items():
+                known[userid] = next(dense) if name else -1
+            self._sorted_userids = None
+            with open(self._file("userids.txt"), "a", encoding="utf-8") as f:
+                f.write("".join("%d\t%s\n" % item for item in usernames.items() if item[1]))
+
+
+def get_username(userid):
+    """Look up the username of a BGG user id, or None if it can't be found."""
+    try:
+        return bgg_core.get_username(userid)
+    except (OSError, LookupError) as e:
+        print("Failed to look up user %s: %s" % (userid, e))
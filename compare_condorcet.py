@@ -1,7 +1,6 @@
 import csv
-import glob
-import os
-import bgg_compare
+import bgg_cli
+import bgg_core
 
 
 def main():
@@ -14,59 +13,32 @@ def main():
     more_games = True
 
     while more_games:
-        search = input("Enter board game to search (leave empty if finished):")
-
-        if search:
-            matches = bgg_compare.find_game(search)
-
-            print("Games found:")
-            for game_id, name in matches.items():
-                print(game_id + "\t" + name)
-            id = input("Enter the number before the intended game:")
-            games[id] = matches[id]
-
-        else:
+        try:
+            game_id, name = bgg_core.select_game()
+            games[game_id] = name
+        # Stop search if no input.
+        except ValueError:
             more_games = False
 
     # If no games entered, compare all downloaded ratings.
     if not games:
-        ids = []
-        for f in glob.glob("[0-9]*.csv"):
-            id = os.path.splitext(f)[0]
-            ids.append(id)
-        game_info = bgg_compare.get_game_info(ids)
-        for i, info in enumerate(game_info):
-            name = info.find("name", attrs={"type": "primary"})["value"]
-            games[ids[i]] = name
+        ids = bgg_core.downloaded_ids("ratings")
+        games = bgg_core.get_game_names(ids)
 
     print("Comparing games:")
 
-    all_ratings = []
-
     for game_id, name in games.items():
-
         print(name)
 
-        ratings = {}
-        filename = "%s.csv" % game_id
-
-        try:
-            ratings = bgg_compare.read_ratings(filename)
-        except:
-            ratings = bgg_compare.get_ratings(game_id)
-            bgg_compare.write_ratings(ratings, filename)
-
-        all_ratings.append(ratings)
-
-    rankings = bgg_compare.condorcet_irv(all_ratings, list(games.keys()))
+    rankings = [row["id"] for row in bgg_cli.rank(list(games.keys()))]
 
     print("Games ranked by Condorcet-IRV:")
 
-    header = ["Rank", "ID", "Game", "Tiebreak"]
+    header = ["Rank", "ID", "Game"]
     print("\t".join(header))
 
-    for i, (game_id, tiebreak) in enumerate(rankings, 1):
-        print("\t".join([str(i), game_id, games[game_id], str(tiebreak)]))
+    for i, game_id in enumerate(rankings, 1):
+        print("\t".join([str(i), game_id, games[game_id]]))
 
     outfile = input("Enter filename to save results (leave empty to not save)")
 
@@ -74,8 +46,8 @@ def main():
         with open(outfile, "w") as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow(header)
-            for i, (game_id, tiebreak) in enumerate(rankings, 1):
-                writer.writerow([str(i), game_id, games[game_id], str(tiebreak)])
+            for i, game_id in enumerate(rankings, 1):
+                writer.writerow([str(i), game_id, games[game_id]])
 
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-import bgg_compare
+import bgg_crawl
 
 
 def main():
@@ -6,16 +6,10 @@ def main():
 
     page = input("Enter the page of rankings to get:")
 
-    games = bgg_compare.get_games_by_rank_page(page)
+    games = bgg_crawl.crawl([int(page)])
 
     for game_id, name in games:
-        filename = "%s.csv" % game_id
         print(name)
-        try:
-            ratings = bgg_compare.read_ratings(filename)
-        except:
-            ratings = bgg_compare.get_ratings(game_id)
-            bgg_compare.write_ratings(ratings, filename)
 
 
 if __name__ == "__main__":
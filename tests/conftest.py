@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bgg_core  # noqa: E402
+import bgg_users  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run each test in its own directory, without the network cache or rate limit."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bgg_core, "response_cache", None)
+    monkeypatch.setattr(bgg_core, "limiter", bgg_core.RateLimiter(1e9, burst=1e9))
+    monkeypatch.setattr(bgg_core, "info_cache", None)
+    monkeypatch.setattr(bgg_users, "tables", {})
+    return tmp_path
+
+
+@pytest.fixture
+def synthetic(monkeypatch):
+    """Answer API requests from a small synthetic catalog."""
+    import bgg_bench
+
+    data = bgg_bench.SyntheticData(num_games=3, num_users=600, density=0.3, num_plays=250)
+
+    def get_data(base_type, params):
+        if base_type == "thing" and params.get("ratingcomments"):
+            return data.ratings_page(params["id"], int(params.get("page", 1)))
+        if base_type == "thing":
+            return data.things_page(params["id"].split(","))
+        return data.plays_page(params["id"], int(params.get("page", 1)),
+                               mindate=params.get("mindate"))
+
+    monkeypatch.setattr(bgg_core, "get_data", get_data)
+    return data
@@ -0,0 +1,24 @@
+import asyncio
+
+import bgg_async
+
+
+def test_game_selected_twice_is_downloaded_once(monkeypatch):
+    selections = iter([("1", "A"), ("2", "B"), ("1", "A")])
+    downloaded = []
+
+    async def select_game():
+        try:
+            return next(selections)
+        except StopIteration:
+            raise ValueError
+
+    async def read_data(id, dir, func, update=False, store=None):
+        await asyncio.sleep(0)
+        downloaded.append(id)
+
+    monkeypatch.setattr(bgg_async, "select_game", select_game)
+    monkeypatch.setattr(bgg_async, "read_data", read_data)
+    games = asyncio.run(bgg_async.select_games("ratings", None))
+    assert games == [("1", "A"), ("2", "B"), ("1", "A")]
+    assert sorted(downloaded) == ["1", "2"]
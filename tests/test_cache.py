@@ -0,0 +1,74 @@
+import pytest
+
+import bgg_cache
+
+
+class Response(object):
+    def __init__(self, text, status_code=200, headers=None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def fetch(cache, page, kind="thing", text=None):
+    return cache.fetch("https://example.com/xmlapi2/thing", {"page": page}, kind,
+                       lambda headers: Response(text or "<items page='%d'/>" % page))
+
+
+def test_fresh_responses_are_served_from_cache():
+    cache = bgg_cache.ResponseCache("cache")
+    fetch(cache, 1)
+    assert fetch(cache, 1, text="changed") == "<items page='1'/>"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ratings_pages_are_only_kept_for_replay():
+    cache = bgg_cache.ResponseCache("cache")
+    fetch(cache, 1, kind="ratings")
+    assert not cache.index
+
+    cache = bgg_cache.ResponseCache("replay", replay=True)
+    fetch(cache, 1, kind="ratings")
+    cache.flush()
+    offline = bgg_cache.ResponseCache("replay", offline=True)
+    assert fetch(offline, 1, kind="ratings", text="unused") == "<items page='1'/>"
+    with pytest.raises(bgg_cache.CacheMiss):
+        fetch(offline, 2, kind="ratings")
+
+
+def test_journal_is_replayed_without_flush():
+    cache = bgg_cache.ResponseCache("cache")
+    for page in range(10):
+        fetch(cache, page)
+    # A new process sees responses stored before the index was written.
+    reopened = bgg_cache.ResponseCache("cache")
+    assert len(reopened.index) == 10
+    assert fetch(reopened, 3, text="changed") == "<items page='3'/>"
+
+
+def test_eviction_keeps_cache_within_max_bytes():
+    cache = bgg_cache.ResponseCache("cache", max_bytes=2000)
+    for page in range(200):
+        fetch(cache, page, text="<items>%s</items>" % ("x%d" % page * 20))
+    assert 0 < cache._size <= 2000
+    assert cache._size == sum(entry["size"] for entry in cache.index.values())
+    reopened = bgg_cache.ResponseCache("cache", max_bytes=2000)
+    assert set(reopened.index) == set(cache.index)
+
+
+def test_storing_scales_linearly(monkeypatch):
+    cache = bgg_cache.ResponseCache("cache")
+    write_index = bgg_cache.ResponseCache._write_index
+    writes = []
+
+    def counting(self):
+        writes.append(len(self.index))
+        write_index(self)
+
+    # The index is rewritten once per journal_size stores, not on every store.
+    monkeypatch.setattr(bgg_cache.ResponseCache, "_write_index", counting)
+    for page in range(5000):
+        fetch(cache, page)
+    cache.flush()
+    assert len(writes) <= 5000 // cache.journal_size + 1
+    assert len(bgg_cache.ResponseCache("cache").index) == 5000
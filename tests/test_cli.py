@@ -0,0 +1,33 @@
+import pytest
+
+import bgg_cli
+import bgg_core
+import bgg_pairs
+
+
+def test_players_needs_ids():
+    with pytest.raises(ValueError):
+        bgg_cli.stats(players=2)
+    with pytest.raises(ValueError):
+        bgg_cli.stats(["1"], players=2, joined=True)
+
+
+def test_missing_names_are_left_empty(monkeypatch):
+    monkeypatch.setattr(bgg_core, "get_game_names", lambda ids: {"1": "A"})
+    rows = bgg_cli.add_names([{"id": "1"}, {"id": "2"}, {"id": "all"}])
+    assert [row["name"] for row in rows] == ["A", "", "All games"]
+
+
+def test_pairs_builds_the_catalog_matrix(synthetic):
+    bgg_cli.fetch(["1", "2"])
+    rows = bgg_cli.pairs()
+    assert rows == []
+
+    # Asking for a game not stored yet downloads it and adds it to the matrix.
+    rows = bgg_cli.pairs(["3", "1"])
+    assert [(row["id"], row["other"]) for row in rows] == [("3", "1")]
+    matrix = bgg_pairs.PairMatrix()
+    assert sorted(matrix.ids) == ["1", "2", "3"]
+    full = bgg_pairs.compute_pairs(path="full")
+    assert rows[0] == {"id": "3", "other": "1", **full.head_to_head("3", "1")}
+    assert rows[0]["wins"] + rows[0]["losses"] + rows[0]["ties"] == rows[0]["common"]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import bgg_compare
+
+# The Schulze method's standard example: 45 voters ranking five candidates.
+SCHULZE_BALLOTS = [(5, "ACBED"), (5, "ADECB"), (8, "BEDAC"), (3, "CABED"), (7, "CAEBD"),
+                   (2, "CBADE"), (7, "DCEBA"), (8, "EBADC")]
+
+
+def ballot_wins(ballots, candidates):
+    """Count pairwise wins from weighted ballots of candidates in order of preference."""
+    wins = np.zeros((len(candidates), len(candidates)), dtype=np.int64)
+    for count, ballot in ballots:
+        for i, a in enumerate(ballot):
+            for b in ballot[i + 1:]:
+                wins[candidates.index(a), candidates.index(b)] += count
+    return wins
+
+
+def test_schulze_example():
+    wins = ballot_wins(SCHULZE_BALLOTS, "ABCDE")
+    assert "".join(bgg_compare.rank_pairwise(wins, list("ABCDE"), "schulze")) == "EACBD"
+
+
+def test_ranked_pairs_example():
+    wins = ballot_wins(SCHULZE_BALLOTS, "ABCDE")
+    assert "".join(bgg_compare.rank_pairwise(wins, list("ABCDE"), "ranked_pairs")) == "ACEBD"
+
+
+def test_copeland_counts_wins_and_draws():
+    # A beats B and C, B draws with C.
+    wins = np.array([[0, 3, 4], [1, 0, 2], [0, 2, 0]])
+    assert list(bgg_compare.copeland_scores(wins)) == [2, 0.5, 0.5]
+    assert bgg_compare.rank_pairwise(wins, ["A", "B", "C"], "copeland") == ["A", "B", "C"]
+
+
+def test_bradley_terry_strengths():
+    # Strengths are proportional to wins when each pair is played once.
+    wins = np.array([[0, 2], [1, 0]])
+    np.testing.assert_allclose(bgg_compare.bradley_terry_scores(wins), [2 / 3, 1 / 3])
+
+    # Ties count as half a win for each game.
+    ties = np.array([[0, 2], [2, 0]])
+    np.testing.assert_allclose(bgg_compare.bradley_terry_scores(wins, ties), [3 / 5, 2 / 5])
+
+
+@pytest.mark.parametrize("method", list(bgg_compare.RANKING_ENGINES))
+def test_engines_follow_a_transitive_order(method):
+    # Every game beats every game after it.
+    ids = ["4", "2", "3", "1", "5"]
+    wins = np.triu(np.full((5, 5), 6), 1) + np.tril(np.full((5, 5), 2), -1)
+    assert bgg_compare.rank_pairwise(wins, ids, method) == ids
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import bgg_compare
+import bgg_core
+
+
+def baseline_rank(user_game_mat, votes, years, ids):
+    """Rank games with the original masked IRV loop, one removal at a time."""
+    cond_mat = np.array([[np.sum(row > other) for other in user_game_mat]
+                         for row in user_game_mat])
+    top_ratings = np.max(user_game_mat, 0)
+    irv = [(np.sum(top_ratings == row), count, -year, -int(game_id))
+           for row, count, year, game_id in zip(user_game_mat, votes, years, ids)]
+
+    diff_mat = cond_mat - cond_mat.T
+    np.fill_diagonal(diff_mat, 1)
+    remaining = list(range(len(ids)))
+    ranks = []
+    while remaining:
+        candidates = list(remaining)
+        while True:
+            winners = [i for i in candidates if all(diff_mat[i, j] > 0 for j in candidates)]
+            assert len(winners) <= 1, "multiple winners found"
+            if winners:
+                break
+            candidates.remove(min(candidates, key=lambda i: irv[i]))
+        ranks.append(str(ids[winners[0]]))
+        remaining.remove(winners[0])
+    return ranks
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_baseline(seed):
+    rng = np.random.default_rng(seed)
+    num_games, num_users = rng.integers(2, 12), rng.integers(5, 60)
+    # Few distinct ratings and missing ones make ties and cycles likely.
+    user_game_mat = rng.integers(1, 5, (num_games, num_users)).astype(float)
+    user_game_mat[rng.random(user_game_mat.shape) < 0.3] = np.nan
+    votes = np.count_nonzero(~np.isnan(user_game_mat), axis=1)
+    years = rng.integers(2000, 2004, num_games)
+    ids = [str(i) for i in rng.permutation(100)[:num_games] + 1]
+
+    cond_mat = bgg_compare.pairwise_wins(user_game_mat, max_cells=64)
+    top_ratings = bgg_compare.top_rating_counts(user_game_mat, max_cells=16)
+    ranks = bgg_compare.condorcet_irv_rank(cond_mat, top_ratings, votes, ids, years)
+    assert ranks == baseline_rank(user_game_mat, votes, years, ids)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_streamed_ranking_matches_dense(seed, monkeypatch):
+    rng = np.random.default_rng(seed)
+    num_games = int(rng.integers(2, 10))
+    ids = [str(i) for i in range(1, num_games + 1)]
+    years = {game_id: {"year": int(rng.integers(2000, 2004))} for game_id in ids}
+    monkeypatch.setattr(bgg_core, "get_games_info", lambda game_ids: years)
+
+    ratings_list = []
+    for _ in ids:
+        users = rng.choice(300, int(rng.integers(1, 300)), replace=False)
+        ratings_list.append({"user%d" % u: float(rng.integers(1, 6)) for u in users})
+
+    dense = bgg_compare.condorcet_irv(ratings_list, ids)
+    # Small enough that users are processed in many blocks.
+    assert bgg_compare.condorcet_irv(ratings_list, ids, max_memory=2000) == dense
@@ -0,0 +1,54 @@
+import threading
+import time
+
+import bgg_bench
+import bgg_core
+import bgg_parse
+
+QUERY = {"id": "1", "ratingcomments": 1, "pagesize": 100}
+
+
+class SlowEarlyPages(bgg_bench.SyntheticData):
+    """Synthetic data whose earlier rating pages take longer, and which counts requests."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def ratings_page(self, game_id, page, pagesize=100):
+        with self.lock:
+            self.requested.append(page)
+        time.sleep(max(0, 6 - page) * 0.02)
+        return super().ratings_page(game_id, page, pagesize)
+
+
+def ratings_pages(workers):
+    pages = []
+    for page, (total, ratings) in bgg_core.pager("thing", QUERY, workers=workers,
+                                                 parse=bgg_parse.parse_ratings):
+        if not ratings:
+            break
+        pages.append((page, ratings))
+    return pages
+
+
+def test_concurrent_pages_are_delivered_in_order():
+    data = SlowEarlyPages(num_games=1, num_users=2000, density=0.5)
+    with bgg_bench.stub_server(data):
+        serial = ratings_pages(1)
+        concurrent = ratings_pages(4)
+    assert len(serial) > 5
+    assert concurrent == serial
+    assert [page for page, _ in concurrent] == list(range(2, len(serial) + 2))
+
+
+def test_stopping_early_cancels_queued_pages():
+    data = SlowEarlyPages(num_games=1, num_users=2000, density=0.5)
+    with bgg_bench.stub_server(data):
+        pages = bgg_core.pager("thing", QUERY, workers=3, parse=bgg_parse.parse_ratings)
+        assert next(pages)[0] == 2
+        pages.close()
+        time.sleep(0.3)
+    # Only pages already in flight were requested, not the rest of the game.
+    assert len(data.requested) <= 1 + 3
@@ -0,0 +1,30 @@
+import numpy as np
+
+import bgg_pairs
+import bgg_store
+
+
+def add_random_games(store, ids, rng, num_users=200):
+    for game_id in ids:
+        users = rng.choice(num_users, rng.integers(1, num_users), replace=False)
+        store.add(game_id, {"user%d" % u: float(rng.integers(1, 11)) for u in users})
+
+
+def test_incremental_updates_match_full_computation():
+    rng = np.random.default_rng(0)
+    store = bgg_store.RatingStore()
+    ids = [str(i) for i in range(1, 21)]
+    add_random_games(store, ids[:5], rng)
+    pairs = bgg_pairs.PairMatrix("incremental").update(store, ids[:5], block_size=2)
+
+    # More games than the initial capacity, and changed ratings.
+    add_random_games(store, ids[5:], rng)
+    add_random_games(store, ["2", "7"], rng)
+    pairs.update(store, ids, block_size=3)
+    pairs = bgg_pairs.PairMatrix("incremental")
+
+    full = bgg_pairs.compute_pairs(store, ids, "full", block_size=5, max_pairs=100)
+    assert pairs.ids == full.ids
+    for name in bgg_pairs.PAIR_ARRAYS:
+        np.testing.assert_allclose(pairs.submatrix(name, ids), full.submatrix(name, ids),
+                                   rtol=1e-6)
@@ -0,0 +1,26 @@
+import pytest
+
+import bgg_bench
+import bgg_parse
+
+HTML_ERROR = "<!DOCTYPE html><html><body>Service unavailable<br></body></html>"
+
+
+@pytest.mark.parametrize("text", ["", HTML_ERROR, '<?xml version="1.0"?><items><item'])
+def test_non_xml_responses_are_errors(text):
+    assert bgg_parse.parse_ratings(text) is None
+    assert bgg_parse.parse_plays(text) is None
+    assert bgg_parse.parse_search(text) == {}
+    assert bgg_parse.parse_things(text) == {}
+
+
+def test_chunked_parsing_matches_whole_responses(monkeypatch):
+    data = bgg_bench.SyntheticData(num_games=2, num_users=300, num_plays=150)
+    pages = [(bgg_parse.parse_ratings, data.ratings_page("1", 1)),
+             (bgg_parse.parse_plays, data.plays_page("1", 1)),
+             (bgg_parse.parse_things, data.things_page(["1", "2"]))]
+    whole = [parse(text) for parse, text in pages]
+    assert whole[0][0] == len(data.ratings["1"][0]) and len(whole[1][1]) == 100
+
+    monkeypatch.setattr(bgg_parse, "chunk_size", 7)
+    assert [parse(text) for parse, text in pages] == whole
@@ -0,0 +1,44 @@
+import bgg_core
+
+
+def scan_done_offset(filename):
+    """Find the offset past the last done line by reading every line."""
+    offset = None
+    position = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            position += len(line)
+            if line == bgg_core.RecordLog.done_line:
+                offset = position
+    return offset
+
+
+def test_interrupted_download_resumes():
+    log = bgg_core.RecordLog("1.jsonl")
+    assert log.done_offset() is None
+    log.append(1, {"a": 1})
+    log.append(2, {"b": 2})
+    with open("1.jsonl", "a") as f:
+        f.write('{"page": 3, "rec')
+    assert not log.complete()
+    assert log.pending() == [(1, {"a": 1}), (2, {"b": 2})]
+
+    log.write({"a": 1, "b": 2})
+    assert log.complete()
+    assert dict(log) == {"a": 1, "b": 2}
+    assert log.pending() == []
+
+
+def test_done_line_is_found_from_the_end():
+    log = bgg_core.RecordLog("1.jsonl", page_size=7)
+    log.write({"record%d" % i: i for i in range(200)})
+    for page in range(1, 40):
+        log.append(page, {"new%d" % page: page})
+        for block_size in [1, 5, 16, 100, 1 << 16]:
+            assert log.done_offset(block_size) == scan_done_offset("1.jsonl")
+    assert dict(log) == {"record%d" % i: i for i in range(200)}
+    assert len(log.pending()) == 39
+
+    log.discard_pending()
+    assert log.pending() == []
+    assert dict(log) == {"record%d" % i: i for i in range(200)}
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+import bgg_bench
+import bgg_compare
+import bgg_core
+import bgg_time
+
+
+def read_ratings(game_id, update=False):
+    return bgg_core.read_data(game_id, "ratings", bgg_compare.get_ratings, update=update)
+
+
+def test_refresh_picks_up_inserted_and_changed_ratings(synthetic):
+    records = read_ratings("1")
+    assert len(records) == len(synthetic.ratings["1"][0])
+
+    # Insert ratings in the middle of the list, where an unordered API puts them.
+    users, ratings = synthetic.ratings["1"]
+    new_users = np.setdiff1d(np.arange(synthetic.num_users), users)[:3]
+    users = np.insert(users, len(users) // 2, new_users)
+    ratings = np.insert(ratings, len(ratings) // 2, [5, 6, 7])
+    synthetic.ratings["1"] = (users, ratings)
+
+    for _ in range(2):
+        records = read_ratings("1", update=True)
+        assert len(records) == len(users)
+        assert {"user%d" % u for u in new_users} <= set(records)
+    assert bgg_core.read_sync("1", "ratings")["total"] == len(users)
+
+    # A changed rating with an unchanged total is still seen.
+    ratings = ratings.copy()
+    ratings[0] = 1 if ratings[0] != 1 else 2
+    synthetic.ratings["1"] = (users, ratings)
+    records = read_ratings("1", update=True)
+    assert float(records["user%d" % users[0]]) == ratings[0]
+
+
+def test_unchanged_total_only_fetches_the_first_page(synthetic, monkeypatch):
+    read_ratings("1")
+    users, ratings = synthetic.ratings["1"]
+    assert len(users) > 100
+    get_data = bgg_core.get_data
+    pages = []
+
+    def counting(base_type, params):
+        pages.append(params.get("page", 1))
+        return get_data(base_type, params)
+
+    monkeypatch.setattr(bgg_core, "get_data", counting)
+
+    # A rating changed past the first page, with an unchanged total.
+    ratings = ratings.copy()
+    ratings[-1] = 1 if ratings[-1] != 1 else 2
+    synthetic.ratings["1"] = (users, ratings)
+    for _ in range(2):
+        records = read_ratings("1", update=True)
+        assert pages == [1]
+        assert len(records) == len(users)
+        assert float(records["user%d" % users[-1]]) != ratings[-1]
+        pages.clear()
+
+    # A full refresh is due once full_refresh_days have passed.
+    monkeypatch.setattr(bgg_compare, "full_refresh_days", 0)
+    records = read_ratings("1", update=True)
+    assert len(pages) > 1
+    assert float(records["user%d" % users[-1]]) == ratings[-1]
+
+
+def test_refresh_removes_deleted_ratings(synthetic):
+    read_ratings("2")
+    users, ratings = synthetic.ratings["2"]
+    synthetic.ratings["2"] = (users[1:], ratings[1:])
+    records = read_ratings("2", update=True)
+    assert "user%d" % users[0] not in records
+    assert len(records) == len(users) - 1
+
+
+def test_incomplete_refresh_keeps_records_and_drops_total(synthetic, monkeypatch):
+    read_ratings("3")
+    users, _ = synthetic.ratings["3"]
+    get_data = bgg_core.get_data
+
+    def failing(base_type, params):
+        if params.get("page", 1) >= 2:
+            return '<?xml version="1.0"?><error><message>Rate limit</message></error>'
+        return get_data(base_type, params)
+
+    monkeypatch.setattr(bgg_core, "get_data", failing)
+    records = read_ratings("3", update=True)
+    assert len(records) == len(users)
+    assert bgg_core.read_sync("3", "ratings").get("total") in (None, len(users))
+
+
+class Response(object):
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+        self.content = text.encode()
+        self.headers = {}
+
+
+def test_throttled_download_is_not_marked_complete(monkeypatch):
+    monkeypatch.setattr(bgg_core, "throttle_delay", 0)
+    throttled = Response(202, "<message>Your request has been accepted</message>")
+    monkeypatch.setattr(bgg_core.session, "get", lambda *args, **kwargs: throttled)
+    with pytest.raises(bgg_core.ThrottledError):
+        read_ratings("1")
+    assert not bgg_core.RecordLog(bgg_core.data_file("1", "ratings")).complete()
+
+
+def test_server_error_is_not_marked_complete(monkeypatch):
+    data = bgg_bench.SyntheticData(num_games=1, num_users=600)
+
+    # The first page is answered, and the next with a well-formed error page.
+    def get(url, params, headers=None):
+        if int(params.get("page", 1)) == 1:
+            return Response(200, data.ratings_page("1", 1))
+        return Response(503, '<?xml version="1.0"?><items></items>')
+
+    monkeypatch.setattr(bgg_core.session, "get", get)
+    with pytest.raises(bgg_core.APIError):
+        read_ratings("1")
+    assert not bgg_core.RecordLog(bgg_core.data_file("1", "ratings")).complete()
+
+
+def test_refresh_picks_up_late_logged_plays(synthetic):
+    records = bgg_core.read_data("1", "plays", bgg_time.get_plays)
+    assert len(records) == len(synthetic.plays["1"]["id"])
+    newest = np.datetime64(synthetic.plays["1"]["date"][0])
+
+    # Plays logged since, one dated a little before the newest play already seen
+    # and one too old for the lookback, which an update doesn't ask for.
+    late = str(newest - 5)
+    old = str(newest - 2 * bgg_time.play_lookback_days)
+    new_ids = synthetic.add_plays("1", [str(newest + 1), late, old])
+    records = bgg_core.read_data("1", "plays", bgg_time.get_plays, update=True)
+    assert {str(i) for i in new_ids[:2]} <= set(records)
+    assert str(new_ids[2]) not in records
+    assert len(records) == len(synthetic.plays["1"]["id"]) - 1
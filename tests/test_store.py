@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+
+import bgg_store
+
+
+def test_ratings_round_trip():
+    store = bgg_store.RatingStore()
+    store.add("1", {"bob": 7, "alice": 8})
+    store.add("2", {"carol": 9.5})
+
+    store = bgg_store.RatingStore()
+    assert len(store) == 2
+    assert store.ratings_dict("1") == {"bob": 7.0, "alice": 8.0}
+    assert store.ratings_dict("2") == {"carol": 9.5}
+    assert list(store.counts(["1", "2"])) == [2, 1]
+
+
+def test_updates_are_compacted():
+    store = bgg_store.RatingStore()
+    store.add("1", {"alice": 1, "bob": 2})
+    store.add("2", {"carol": 3})
+    reader = bgg_store.RatingStore()
+    for rating in range(4, 8):
+        store.add("1", {"alice": rating})
+    assert len(store.indices) == 7
+    assert store.orphaned() == 5 / 7
+    checksum = store.checksum("1")
+
+    # Adds don't renumber rows, so a store opened earlier still reads its games.
+    assert reader.ratings_dict("2") == {"carol": 3.0}
+
+    store.compact()
+    assert len(store.indices) == 2
+    assert store.orphaned() == 0
+    assert store.ratings_dict("1") == {"alice": 7.0}
+    assert store.ratings_dict("2") == {"carol": 3.0}
+    assert store.checksum("1") == checksum
+    assert bgg_store.RatingStore().ratings_dict("1") == {"alice": 7.0}
+
+
+def test_interrupted_compaction_is_finished(monkeypatch):
+    store = bgg_store.RatingStore()
+    store.add("1", {"alice": 1, "bob": 2})
+    store.add("1", {"alice": 3})
+    with monkeypatch.context() as m:
+        m.setattr(bgg_store.RatingStore, "_finish_commit", lambda self: None)
+        store.compact()
+    assert os.path.exists("ratings_store/commit.json")
+
+    store = bgg_store.RatingStore()
+    assert not os.path.exists("ratings_store/commit.json")
+    assert len(store.indices) == 1
+    assert store.ratings_dict("1") == {"alice": 3.0}
+
+
+def test_other_files_are_left_alone():
+    store = bgg_store.RatingStore()
+    store.add("1", {"alice": 1})
+    # Such as another process's file about to be moved into place.
+    open("ratings_store/games.json.tmp", "w").close()
+    bgg_store.RatingStore()
+    assert os.path.exists("ratings_store/games.json.tmp")
+
+
+def test_interrupted_add_is_dropped():
+    store = bgg_store.RatingStore()
+    store.add("1", {"alice": 1, "bob": 2})
+    # Ratings of a second game were appended, but not its row.
+    with open("ratings_store/indices.i4", "ab") as f:
+        np.array([0, 1, 2], dtype=np.int32).tofile(f)
+    with open("ratings_store/data.f4", "ab") as f:
+        np.array([3], dtype=np.float32).tofile(f)
+
+    store = bgg_store.RatingStore()
+    assert len(store.indices) == len(store.data) == 2
+    store.add("2", {"carol": 3})
+    assert store.ratings_dict("1") == {"alice": 1.0, "bob": 2.0}
+    assert store.ratings_dict("2") == {"carol": 3.0}
@@ -0,0 +1,33 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import bgg_core
+
+
+def write_one(id):
+    bgg_core.write_sync(id, "ratings", {"total": int(id)})
+
+
+def test_sync_is_kept_per_id():
+    bgg_core.write_sync("1", "ratings", {"total": 5})
+    bgg_core.write_sync("2", "ratings", {"total": 7})
+    assert bgg_core.read_sync("1", "ratings")["total"] == 5
+    assert bgg_core.read_sync("2", "ratings")["total"] == 7
+    assert bgg_core.read_sync("3", "ratings") == {}
+    # Sync files are not mistaken for downloaded data.
+    assert bgg_core.downloaded_ids("ratings") == []
+
+
+def test_reading_sync_writes_nothing():
+    os.makedirs("ratings")
+    bgg_core.read_sync("1", "ratings")
+    assert not os.path.exists("ratings_sync.json")
+    assert not os.path.exists("ratings/sync")
+
+
+def test_processes_do_not_lose_updates():
+    ids = [str(i) for i in range(1, 41)]
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(write_one, ids))
+    assert [bgg_core.read_sync(id, "ratings")["total"] for id in ids] == list(range(1, 41))
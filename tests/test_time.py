@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+import pytest
+
+import bgg_time
+
+
+def test_interrupted_column_cache_write_is_not_kept(synthetic, monkeypatch):
+    savez = np.savez
+
+    def interrupted(f, **columns):
+        f.write(b"PK\x03\x04")
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(np, "savez", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        bgg_time.read_play_columns("1")
+    assert not os.path.exists("plays/1.npz")
+
+    monkeypatch.setattr(np, "savez", savez)
+    columns = bgg_time.read_play_columns("1")
+    assert len(columns["user"]) == len(synthetic.plays["1"]["id"])
+    cached = bgg_time.read_play_columns("1")
+    assert all(np.array_equal(cached[name], column) for name, column in columns.items())
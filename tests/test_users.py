@@ -0,0 +1,21 @@
+import bgg_core
+import bgg_users
+
+
+def test_failed_lookups_are_retried(monkeypatch):
+    names = {1: "alice", 2: None}
+
+    def get_username(userid):
+        if userid == 3:
+            raise ConnectionError("offline")
+        return names[userid]
+
+    monkeypatch.setattr(bgg_core, "get_username", get_username)
+    table = bgg_users.open_table()
+    assert list(table.resolve([1, 2, 3])) == [0, -1, -1]
+
+    names[2] = "bob"
+    monkeypatch.setattr(bgg_users, "tables", {})
+    table = bgg_users.open_table()
+    assert list(table.lookup([1, 2, 3])) == [0, -1, -1]
+    assert list(table.resolve([1, 2, 3])) == [0, 1, -1]
@@ -1,5 +1,6 @@
 import csv
-import bgg_compare
+import bgg_cli
+import bgg_crawl
 from math import ceil
 
 
@@ -9,51 +10,26 @@ def main():
     """
 
     # Ask for number of games to compare.
-    games = {}
     ranknum = int(input("Enter number of games to compare:"))
     pages = ceil(ranknum/100)
-    games_list = []
-
-    for page in range(1, pages):
-        games_list += bgg_compare.get_games_by_rank_page(page)
-
-    last_page_games = bgg_compare.get_games_by_rank_page(pages)
-    remaining_games = ranknum % 100
-    if remaining_games:
-        games_list += last_page_games[:remaining_games]
-    else:
-        games_list += last_page_games
+    games_list = bgg_crawl.crawl(range(1, pages + 1), limit=ranknum)
 
     games = dict(games_list)
 
     print("Comparing games:")
 
-    all_ratings = []
-
     for game_id, name in games.items():
-
         print(name)
 
-        ratings = {}
-        filename = "%s.csv" % game_id
-
-        try:
-            ratings = bgg_compare.read_ratings(filename)
-        except:
-            ratings = bgg_compare.get_ratings(game_id)
-            bgg_compare.write_ratings(ratings, filename)
-
-        all_ratings.append(ratings)
-
-    rankings = bgg_compare.condorcet_irv(all_ratings, list(games.keys()))
+    rankings = [row["id"] for row in bgg_cli.rank(list(games.keys()))]
 
     print("Games ranked by Condorcet-IRV:")
 
-    header = ["Rank", "ID", "Game", "Tiebreak"]
+    header = ["Rank", "ID", "Game"]
     print("\t".join(header))
 
-    for i, (game_id, tiebreak) in enumerate(rankings, 1):
-        print("\t".join([str(i), game_id, games[game_id], str(tiebreak)]))
+    for i, game_id in enumerate(rankings, 1):
+        print("\t".join([str(i), game_id, games[game_id]]))
 
     outfile = input("Enter filename to save results (leave empty to not save)")
 
@@ -61,8 +37,8 @@ def main():
         with open(outfile, "w") as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow(header)
-            for i, (game_id, tiebreak) in enumerate(rankings, 1):
-                writer.writerow([str(i), game_id, games[game_id], str(tiebreak)])
+            for i, game_id in enumerate(rankings, 1):
+                writer.writerow([str(i), game_id, games[game_id]])
 
 
 if __name__ == "__main__":